@@ -1,14 +1,9 @@
 import os
 import sys
 import asyncio
-import time
 import nest_asyncio
+from concurrent.futures.process import BrokenProcessPool
 from IPython.display import clear_output
-from tqdm import tqdm
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
-import numpy as np
-from pdf2image import convert_from_path
-from PIL import Image
 
 # ✅ Add parent directory to sys.path to import custom utility modules
 parent_dir = os.path.join(os.getcwd(), "..")
@@ -18,9 +13,24 @@ if parent_dir not in sys.path:
 from utility.audio import *
 from utility.pdf import *
 from utility.api import *
+from utility.tts import synthesize_speech, TTS_RATE, TTS_CONCURRENCY
+from utility.video import get_encode_pool, reset_encode_pool, encode_renditions, concat_segments, package_hls, remove_hls, VIDEO_FPS, AUDIO_BITRATE, ENCODE_WORKERS
+from utility.gemini import SlideScriptGenerator, script_cache_key, GEMINI_CONCURRENCY, GEMINI_BATCH_SIZE
+from utility.pipeline import Stage, run_pipeline, PipelineError
+from utility.align import align_transcript, ALIGN_TRANSCRIPT
+from utility.cache import hash_key
+from utility.manifest import SlideManifest, prune_render_sets
+from utility.artifacts import get_store
+from utility.dedup import detect_duplicates, SLIDE_DEDUP, DEDUP_MODES
+from utility.scheduler import cpu_slot_async
+from utility import metrics
 from dotenv import load_dotenv
 load_dotenv()
 THREAD_COUNT = int(os.getenv("THREAD_COUNT"))
+RASTER_CONCURRENCY = int(os.getenv("RASTER_CONCURRENCY", "2"))  # pages rendered at the same time
+SLIDE_RETRIES = int(os.getenv("SLIDE_RETRIES", "2"))               # extra attempts per slide before the job fails
+SLIDE_RETRY_DELAY = float(os.getenv("SLIDE_RETRY_DELAY", "2"))     # seconds before the first retry (doubles after)
+MANIFEST_SAVE_INTERVAL = float(os.getenv("MANIFEST_SAVE_INTERVAL", "2"))  # checkpoint interval of finished slide work
 # ✅ Apply async fix for Jupyter Notebook environments
 nest_asyncio.apply()
 
@@ -55,158 +65,328 @@ async def api(
     output_text_path: str,
     num_of_pages="all",
     resolution: int = 480,  # Default to 480p
-    tts_model: str = 'edge'
+    tts_model: str = 'edge',
+    slide_overrides: dict = None,  # {slide index: script} edited by the user
+    on_progress=None,  # callback(stage, done=None, total=None), e.g. utility.progress.ProgressReporter
+    resolutions=None,  # extra renditions, e.g. [360, 720]; all come from one rasterization and audio pass
+    hls: bool = False,  # also package the renditions as an HLS ladder (video/hls/master.m3u8)
+    dedup: str = None  # repeated / build-up pages: "off", "merge" (narrate once) or "reuse" (share the script)
 ):
     print("\n🚀 Starting the process...\n")
+    report = on_progress or (lambda stage, done=None, total=None: None)
     ensure_directories_exist(output_audio_dir, output_video_dir, os.path.dirname(output_text_path))
     # ✅ Validate resolution input
     if resolution not in RESOLUTION_MAP:
         print(f"⚠️ Invalid resolution selected: {resolution}p. Defaulting to 480p.")
         resolution = 480
 
-    TARGET_WIDTH, TARGET_HEIGHT = RESOLUTION_MAP[resolution]
-    print(f"📏 Selected Resolution: {resolution}p ({TARGET_WIDTH}x{TARGET_HEIGHT})")
+    # ✅ Rendition ladder: every requested size is encoded from the same frames and audio
+    ladder = {resolution}
+    for extra in resolutions or []:
+        if int(extra) in RESOLUTION_MAP:
+            ladder.add(int(extra))
+        else:
+            print(f"⚠️ Ignoring invalid resolution: {extra}p.")
+    ladder = sorted(ladder)
+    for res in ladder:
+        print(f"📏 Selected Resolution: {res}p ({RESOLUTION_MAP[res][0]}x{RESOLUTION_MAP[res][1]})")
     if video_path is None:
         print(f"No MP4 passed in. Go on processing without video.")
         script = "No video for this file. Please use the passage only to generate."
+        segments = []
     else:
-        # ✅ Step 1: Convert MP4 to MP3
-        print(f"🎵 Converting MP4 to MP3: {video_path}")
-        audio = convert_mp4_to_mp3(video_path)
+        # ✅ Recordings seen before (same content, same model) reuse their transcript
+        recording_sha = get_store().content_hash(video_path)
+        transcript = cached_transcript(recording_sha, "base")
+        if transcript is not None:
+            print("♻️ Reusing the transcript of an identical recording.")
+            metrics.inc("transcript_cache_hits_total")
+        else:
+            # ✅ Step 1: Decode the audio track straight to 16 kHz PCM (no intermediate MP3)
+            report("audio_extraction")
+            print(f"🎵 Decoding audio from: {video_path}")
+            audio = load_audio_pcm(video_path)
+            pcm_path = pcm_file(audio)
+
+            # ✅ Step 2: Transcribe the audio
+            print("📝 Transcribing audio to text...")
+            report("transcription")
+
+            def write_partial_transcript(text):
+                # ✅ Long recordings: the transcript grows here as chunks finish
+                with open(output_text_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+
+            try:
+                transcript = transcribe_audio(audio, model_size="base", on_partial=write_partial_transcript)
+            finally:
+                del audio  # unmaps a memory-mapped recording
+                remove_pcm_file(pcm_path)
+            save_transcript(recording_sha, "base", transcript)
+        script = transcript['text']
+        segments = transcript.get('segments', [])
 
-        # ✅ Step 2: Transcribe the audio
-        print("📝 Transcribing audio to text...")
-        script = transcribe_audio(audio, model_size="base")['text']
 
     # ✅ Step 4: Get API key and process PDF
     keys = eval(os.getenv("api_key"))
     print(f"📄 Extracting text from PDF: {pdf_file_path}")
+    report("pdf_ingest")
+
+    # ✅ Single-pass ingest: page count, per-page text and content hash (cached per document)
+    pdf_info = ingest_pdf(pdf_file_path)
+    text_array = pdf_info["texts"]
 
     # ✅ Detect total number of pages if 'all' is set
     if num_of_pages == "all":
-        total_pages = len(convert_from_path(
-            pdf_file_path, poppler_path=poppler_path,thread_count=THREAD_COUNT
-        ))
+        total_pages = pdf_info["page_count"]
         print(f"📚 Detected total pages: {total_pages}")
     else:
         try:
-            total_pages = int(num_of_pages)  # Convert to integer
+            total_pages = min(int(num_of_pages), pdf_info["page_count"])  # Convert to integer
         except Exception:
-            total_pages = len(convert_from_path(
-                pdf_file_path, poppler_path=poppler_path, thread_count=THREAD_COUNT
-            ))
+            total_pages = pdf_info["page_count"]
     print(f"📃Selected Number of Pages: {num_of_pages}")
-    text_array = pdf_to_text_array(pdf_file_path)
-
-    # ✅ Step 5: Use AI model to generate responses
-    print(f"🤖 Generating AI responses for {total_pages} pages...")
-    response_array = gemini_chat(text_array[:total_pages], script=script, keys=keys)
-    
-
-    # ✅ Step 6: Convert AI-generated text to speech (without saving permanently)
-    print("🔊 Generating speech from AI responses...")
-    audio_files = []  # Store temporary file paths
-
-    tasks = []
-    for idx, response in enumerate(tqdm(response_array, desc="Processing Audio")):
-        filename = f"audio_{idx}.mp3"  # Unique name for each file
-        tasks.append(edge_tts_example(response, output_audio_dir, filename, tts_model))   
 
-    # ✅ Gather all async tasks
-    audio_files = await asyncio.gather(*tasks)
-
-    print("✅ All audio responses generated as temporary files!")
-    # ✅ Step 7: Convert PDF pages to images
-    print(f"🖼️ Converting {total_pages} PDF pages to images...")
-
-    pages = convert_from_path(
+    # ✅ Give every slide prompt only the part of the transcript that belongs to it
+    if ALIGN_TRANSCRIPT and segments:
+        slide_scripts = align_transcript(segments, text_array[:total_pages])
+        print(f"🧭 Aligned {len(segments)} transcript segments to {total_pages} slides")
+    else:
+        slide_scripts = [script] * total_pages
+
+    # ✅ Repeated and build-up pages (PowerPoint animation steps exported as pages)
+    dedup = dedup or SLIDE_DEDUP
+    if dedup not in DEDUP_MODES:
+        print(f"⚠️ Unknown dedup mode: {dedup}. Keeping every page.")
+        dedup = "off"
+    pages = list(range(total_pages))
+    script_source = {}  # page -> page whose script it reuses
+    if dedup != "off" and total_pages > 1:
+        runs = detect_duplicates(pdf_file_path, pdf_info["sha256"], text_array[:total_pages], poppler_path)
+        for first, last in runs:
+            if dedup == "merge":
+                # One narration over the whole group, shown on its last (complete) page
+                windows = list(dict.fromkeys(slide_scripts[first:last + 1]))
+                slide_scripts[last] = " ".join(windows)
+                for idx in range(first, last):
+                    pages.remove(idx)
+            else:
+                for idx in range(first + 1, last + 1):
+                    script_source[idx] = first
+        if dedup == "merge" and len(pages) < total_pages:
+            print(f"🪞 Merged into {len(pages)} narrated slides (from {total_pages} pages)")
+
+    # ✅ Per-slide manifest: every artifact remembers the hash of its inputs,
+    #    so a re-render only rebuilds slides whose inputs changed. It is saved
+    #    as slides progress, so a failed or interrupted job resumes where it stopped.
+    render_set = pdf_info["sha256"][:16]
+    renders_root = os.path.join(os.path.dirname(os.path.normpath(output_video_dir)), "renders")
+    render_dir = os.path.join(renders_root, render_set)
+    slide_audio_dir = os.path.join(output_audio_dir, render_set)
+    ensure_directories_exist(render_dir, slide_audio_dir)
+    manifest = SlideManifest(os.path.join(render_dir, "manifest.json"), autosave_interval=MANIFEST_SAVE_INTERVAL)
+    slide_overrides = {int(k): v for k, v in (slide_overrides or {}).items()}
+
+    # ✅ Steps 5-8 run as a streaming pipeline: slide i can be encoding while
+    #    slide i+1 is in TTS and slide i+2 is still waiting on Gemini
+    generator = None
+    loop = asyncio.get_running_loop()
+    tts_semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+
+    # ✅ Frames are rendered by poppler directly at the largest rendition size, in batches of pages
+    frame_size = RESOLUTION_MAP[ladder[-1]]
+    frame_hashes = {idx: hash_key(pdf_info["sha256"], idx, *frame_size) for idx in range(total_pages)}
+    frame_path = lambda idx: os.path.join(render_dir, f"slide_{idx}.png")
+    rasterizer = PageRasterizer(
         pdf_file_path,
-        poppler_path=poppler_path,
-        first_page=1,
-        last_page=total_pages,
-        thread_count=THREAD_COUNT
+        [idx for idx in pages if not manifest.lookup(idx, "frame", frame_hashes[idx])],
+        frame_path, size=frame_size, poppler_path=poppler_path,
     )
-    print("🎬 Creating video clips...")
-    video_clips = []
 
-    for img, audio_file in tqdm(zip(pages, audio_files), total=len(audio_files), desc="Processing Videos"):
+    script_tasks = {}  # source page -> task generating its script
+
+    async def generate_script(idx):
+        nonlocal generator
+        if generator is None:
+            generator = SlideScriptGenerator(script, keys=keys)
+            generator.register(
+                (i, text_array[i], slide_scripts[i]) for i in pages if i not in slide_overrides and i not in script_source
+            )
+        with metrics.stage("llm", slide=idx):
+            return await generator.generate(idx, text_array[idx], script=slide_scripts[idx])
+
+    async def script_stage(slide):
+        # ✅ Step 5: Use AI model to generate responses (only for slides without a fresh script)
+        idx = slide["idx"]
+        # Pages repeating / building on an earlier page share its script (one Gemini request)
+        source = idx if idx in slide_overrides else script_source.get(idx, idx)
+        if source in slide_overrides:
+            slide["text_hash"] = hash_key("override", slide_overrides[source])
+            slide["text"] = slide_overrides[source]
+            manifest.record(idx, "text", slide["text_hash"], value=slide["text"])
+            return slide
+
+        slide["text_hash"] = script_cache_key(slide_scripts[source], text_array[source], source)
+        entry = manifest.lookup(idx, "text", slide["text_hash"])
+        if entry:
+            slide["text"] = entry["value"]
+            return slide
+
+        task = script_tasks.get(source)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = script_tasks[source] = asyncio.ensure_future(generate_script(source))
+        slide["text"] = await asyncio.shield(task)
+        manifest.record(idx, "text", slide["text_hash"], value=slide["text"])
+        return slide
+
+    async def speech_stage(slide):
+        # ✅ Step 6: Convert AI-generated text to speech (only for changed scripts)
+        idx = slide["idx"]
+        slide["audio_hash"] = hash_key(slide["text"], tts_model, TTS_RATE)
+        entry = manifest.lookup(idx, "audio", slide["audio_hash"])
+        if entry:
+            slide["audio"] = entry["path"]
+            return slide
+
+        with metrics.stage("tts", slide=idx):
+            slide["audio"] = await synthesize_speech(
+                slide["text"], slide_audio_dir, f"audio_{idx}.mp3", tts_model, semaphore=tts_semaphore
+            )
+        if slide["audio"]:
+            metrics.add_bytes("tts", os.path.getsize(slide["audio"]))
+            manifest.record(idx, "audio", slide["audio_hash"], path=slide["audio"])
+        else:
+            manifest.forget(idx, "audio")
+            if slide["text"] and slide["text"].strip():
+                # ⚠️ A failed TTS call must not silently drop the page: let the slide retry / the job fail
+                raise RuntimeError(f"Speech synthesis failed for page {idx + 1}")
+        return slide
+
+    async def frame_stage(slide):
+        # ✅ Step 7: Rasterize this page at the target size (skipped if its frame is already on disk)
+        idx = slide["idx"]
+        slide["frame_hash"] = frame_hashes[idx]
+        slide["frame"] = frame_path(idx)
+        if not manifest.lookup(idx, "frame", slide["frame_hash"]):
+            with metrics.stage("rasterization", slide=idx):
+                await rasterizer.render(idx)
+            metrics.add_bytes("rasterization", os.path.getsize(slide["frame"]))
+            manifest.record(idx, "frame", slide["frame_hash"], path=slide["frame"])
+        return slide
+
+    async def encode_stage(slide):
+        # ✅ Step 8: Encode the slide directly with ffmpeg (still image + audio) in a process pool,
+        #    all missing renditions in one run (decode once, split, scale per size)
+        idx = slide["idx"]
+        audio_file = slide["audio"]
+        slide["segments"] = {}
         # 如果 audio_file 是 None 或不是字串，直接跳過
         if not isinstance(audio_file, str) or not audio_file:
             print(f"⚠️ Skipping slide because no audio: {audio_file}")
-            continue
+            return slide
 
         # 確認副檔名才進行後續
         if not audio_file.endswith(".mp3"):
             print(f"⚠️ Skipping non-mp3 file: {audio_file}")
-            continue
-
-        # ✅ Resize Image to Selected Resolution
-        img_resized = img.resize((TARGET_WIDTH, TARGET_HEIGHT), Image.LANCZOS)
-
-        # ✅ Convert resized PIL image to NumPy array for MoviePy
-        frame = np.array(img_resized)
-
-        # ✅ Load audio from temporary file
-        audioclip = AudioFileClip(audio_file)  # Load using file path
-        duration = audioclip.duration  # Match image duration to audio
-
-        # ✅ Create ImageClip & Set Duration
-        image_clip = ImageClip(frame).set_duration(duration)
-
-        # ✅ Attach audio to the image clip
-        video_clip = image_clip.set_audio(audioclip)
-
-        # ✅ Store the video clip in the list
-        video_clips.append(video_clip)
-    
-
-
-    # ✅ Step 10: Concatenate video clips
-    print("📹 Concatenating video clips...")
-    final_video = concatenate_videoclips(video_clips, method="chain")
-
-    # ✅ Step 12: Export final video
-    output_video_path = os.path.join(output_video_dir, f"output_video_{resolution}p.mp4")
-    print(f"📤 Exporting final video to: {output_video_path}")
-    final_video.write_videofile(
-        output_video_path,
-        fps=24,
-        logger=None,
-        audio_bitrate="50k",
-        write_logfile=False,
-        threads=THREAD_COUNT,
-        ffmpeg_params=[
-            "-b:v", "5M",  # ✅ Controls bitrate (~5Mbps for faster encoding)
-            "-preset", "ultrafast",  # ✅ Faster encoding, slightly lower quality
-            "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",  # ✅ Ensures correct resolution
-            "-pix_fmt", "yuv420p",  # ✅ Standard pixel format
-        ],
-    )
+            return slide
+
+        missing = []
+        for res in ladder:
+            width, height = RESOLUTION_MAP[res]
+            segment_hash = hash_key(slide["frame_hash"], slide["audio_hash"], width, height, VIDEO_FPS, AUDIO_BITRATE)
+            segment_path = os.path.join(render_dir, f"segment_{idx}_{res}p.mp4")
+            if not manifest.lookup(idx, f"segment_{res}p", segment_hash):
+                missing.append((res, segment_hash, segment_path))
+            slide["segments"][res] = segment_path
+
+        if missing:
+            renditions = [(path, *RESOLUTION_MAP[res]) for res, _, path in missing]
+            async with cpu_slot_async("encode"):
+                with metrics.stage("encode", slide=idx, renditions=len(renditions)):
+                    encode_pool = get_encode_pool()
+                    try:
+                        await loop.run_in_executor(encode_pool, encode_renditions, slide["frame"], audio_file, renditions)
+                    except BrokenProcessPool:
+                        # ✅ A dead encoder breaks the pool for good; let the retry start a fresh one
+                        reset_encode_pool(encode_pool)
+                        raise
+            for res, segment_hash, segment_path in missing:
+                metrics.add_bytes("encode", os.path.getsize(segment_path))
+                manifest.record(idx, f"segment_{res}p", segment_hash, path=segment_path)
+        return slide
+
+    print(f"🤖 Streaming {len(pages)} pages through script -> speech -> frame -> encode...")
+    finished_slides = 0
+    report("slides", 0, len(pages))
+
+    def slide_finished(slide):
+        nonlocal finished_slides
+        finished_slides += 1
+        report("slides", finished_slides, len(pages))
 
-    clear_output(wait=True)
-    print(f"🎉 Final {resolution}p video created successfully with {total_pages} pages!")
-
-
-    temp_audiofile = os.path.join(output_audio_dir, "output_videoTEMP_MPY_wvf_snd.mp3")
-    
-    # ✅ Ensure temp audio file is not locked
-    time.sleep(3)
     try:
-        if os.path.exists(temp_audiofile):
-            os.remove(temp_audiofile)
-            print(f"✅ Deleted temp audio file: {temp_audiofile}")
-    except PermissionError:
-        print(f"⚠️ Warning: Could not delete {temp_audiofile}. It might still be in use.")
+        slides = await run_pipeline(
+            ({"idx": idx} for idx in pages),
+            [
+                Stage("llm", script_stage, (GEMINI_CONCURRENCY or 2 * len(keys)) * GEMINI_BATCH_SIZE),
+                Stage("tts", speech_stage, TTS_CONCURRENCY),
+                Stage("raster", frame_stage, RASTER_CONCURRENCY),
+                Stage("encode", encode_stage, ENCODE_WORKERS),
+            ],
+            on_result=slide_finished,
+            retries=SLIDE_RETRIES,
+            retry_delay=SLIDE_RETRY_DELAY,
+            fail_fast=False,  # finish (and checkpoint) every other slide first
+        )
+    except PipelineError as e:
+        failed = sorted(slide["idx"] for slide, _, _ in e.failures)
+        raise RuntimeError(
+            f"{len(failed)} slide(s) failed after {SLIDE_RETRIES} retries (pages {', '.join(str(i + 1) for i in failed[:10])}): "
+            f"{e.failures[0][2]}"
+        ) from e
+    finally:
+        manifest.save()
+
+    slides.sort(key=lambda slide: slide["idx"])
+
+    # ✅ Step 10: Join segments with the concat demuxer (stream copy, no re-encode), once per rendition
+    report("concat")
+    output_videos = {}
+    for res in ladder:
+        segment_paths = [slide["segments"][res] for slide in slides if slide["segments"]]
+        output_videos[res] = os.path.join(output_video_dir, f"output_video_{res}p.mp4")
+        print(f"📤 Exporting final video to: {output_videos[res]}")
+        concat_segments(segment_paths, output_videos[res])
+
+    # ✅ The videos above replaced the previous ones: only this deck's working set can still be re-rendered
+    prune_render_sets([renders_root, output_audio_dir], keep=render_set)
+
+    # ✅ Step 11: Optional HLS ladder (stream copy of the renditions above)
+    hls_dir = os.path.join(output_video_dir, "hls")
+    if hls:
+        report("hls")
+        master = package_hls(
+            [(output_videos[res], *RESOLUTION_MAP[res], f"{res}p") for res in ladder],
+            hls_dir,
+        )
+        print(f"📺 HLS ladder written to: {master}")
+    else:
+        remove_hls(hls_dir)  # a ladder from an earlier job would no longer match the videos
+
+    clear_output(wait=True)
+    print(f"🎉 Final {', '.join(f'{res}p' for res in ladder)} video created successfully with {total_pages} pages!")
 
     # ✅ Step 13: Remove the transcript text file
-    if os.path.exists(output_text_path):
-        try:
-            os.remove(output_text_path)
-            print(f"✅ Deleted transcript file: {output_text_path}")
-        except Exception as e:
-            print(f"⚠️ Failed to delete transcript file: {e}")
+    with metrics.stage("cleanup"):
+        if os.path.exists(output_text_path):
+            try:
+                os.remove(output_text_path)
+                print(f"✅ Deleted transcript file: {output_text_path}")
+            except Exception as e:
+                print(f"⚠️ Failed to delete transcript file: {e}")
 
     print("✅ Cleanup process completed!")
+    return [output_videos[res] for res in ladder]
 # ✅ Step 14: Run async function properly with parameters
 if __name__ == "__main__":
     asyncio.run(api(
@@ -1,16 +1,27 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, flash, session
+from flask import Flask, render_template, request, redirect, url_for, send_file, send_from_directory, jsonify, flash, session, Response
 import os
-import asyncio
-import threading
+import json
+import time
 import platform
 import shutil
 import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
 from werkzeug.utils import secure_filename
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import IntegrityError
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 # from flask_mail import Mail, Message
-from api.whisper_LLM_api import api
+from utility.job_queue import JobQueue, QueueFullError
+from utility.pdf import count_pages
+from utility.artifacts import get_store, upload_owner, video_owner, user_prefix
+from utility.manifest import prune_render_sets
+from utility import metrics
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -21,8 +32,36 @@ app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["OUTPUT_FOLDER"] = "output"
 app.config["ALLOWED_EXTENSIONS"] = {"mp4", "pdf"}
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///users.db"
+# ✅ Pooled connections; each request borrows one instead of opening users.db again
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "poolclass": QueuePool,
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "connect_args": {"timeout": 30, "check_same_thread": False},
+}
+# ✅ bcrypt work factor: each +1 doubles the CPU time of a login (existing hashes are upgraded on login)
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
 system_os = platform.system()
 
+# ✅ Logged-in users are cached between requests (USER_CACHE_SECONDS). Deleting a user touches a
+#    stamp file that every web process checks, so all of them drop their cache at once
+USER_CACHE_SECONDS = float(os.getenv("USER_CACHE_SECONDS", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_stamp = None
+
+
+@event.listens_for(Engine, "connect")
+def configure_sqlite(dbapi_connection, connection_record):
+    # WAL: page loads keep reading while a signup writes; NORMAL is durable enough with WAL
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 # mail = Mail(app)
@@ -39,56 +78,84 @@ admin_password = os.getenv("admin_password")
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 os.makedirs(app.config["OUTPUT_FOLDER"], exist_ok=True)
 
+# ✅ Persistent Job Queue (lives next to users.db)
+job_queue = JobQueue(os.path.join(app.instance_path, "jobs.db"))
+USERS_CHANGED_PATH = os.path.join(app.instance_path, "users.changed")
+
+# ✅ Progress streaming configuration (override in .env)
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", "1"))     # seconds between job DB reads per stream
+SSE_MAX_SECONDS = float(os.getenv("SSE_MAX_SECONDS", "300"))       # streams are recycled; EventSource reconnects
+
 # ✅ User Model
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
 
+# ✅ What request handlers need from the logged-in user (safe to share between threads)
+class SessionUser(UserMixin):
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+def users_changed_at():
+    """mtime of the stamp file touched whenever a user is deleted (0 if never)."""
+    try:
+        return os.stat(USERS_CHANGED_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    global _user_cache_stamp
+    user_id = int(user_id)
+    now = time.monotonic()
+    stamp = users_changed_at()
+    with _user_cache_lock:
+        if stamp != _user_cache_stamp:
+            _user_cache.clear()
+            _user_cache_stamp = stamp
+        cached = _user_cache.get(user_id)
+        if cached is not None and cached[1] > now:
+            _user_cache.move_to_end(user_id)
+            return cached[0]
+    user = User.query.get(user_id)
+    if user is None:
+        with _user_cache_lock:
+            _user_cache.pop(user_id, None)
+        return None
+    session_user = SessionUser(user.id, user.email)
+    with _user_cache_lock:
+        _user_cache[user_id] = (session_user, now + USER_CACHE_SECONDS)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return session_user
+
+def invalidate_user(user_id):
+    """Drops user_id from the user cache of every web process."""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+    with open(USERS_CHANGED_PATH, "a"):
+        pass
+    # Always a new mtime, even on filesystems with coarse timestamps
+    stamp = max(time.time_ns(), users_changed_at() + 1)
+    os.utime(USERS_CHANGED_PATH, ns=(stamp, stamp))
+
+def hash_password(password):
+    return bcrypt.generate_password_hash(password).decode("utf-8")
+
+def needs_rehash(password_hash):
+    """True if the hash was made with another work factor than BCRYPT_LOG_ROUNDS ("$2b$12$...")."""
+    try:
+        return int(password_hash.split("$")[2]) != app.config["BCRYPT_LOG_ROUNDS"]
+    except (IndexError, ValueError):
+        return False
 
 # ✅ Check Allowed File Types
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXTENSIONS"]
 
-# ✅ Background Processing Task
-def run_processing(video_path, pdf_path, num_of_pages, resolution, user_folder, voice):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
-    video_folder = os.path.join(user_folder, 'video')
-    os.makedirs(video_folder, exist_ok=True)
-
-    status_file = os.path.join(video_folder, "processing.txt")
-    # ✅ Mark processing as ongoing
-    with open(status_file, "w") as f:
-        f.write("processing")
-
-
-    try:
-        loop.run_until_complete(api(
-            video_path=video_path,
-            pdf_file_path=pdf_path,
-            #poppler_path=None if system_os == "Windows" else "./poppler/poppler-0.89.0/bin", 
-            poppler_path=None,
-            output_audio_dir=os.path.join(user_folder, 'audio'),
-            output_video_dir=os.path.join(user_folder, 'video'),
-            output_text_path=os.path.join(user_folder, "text_output.txt"),
-            num_of_pages=num_of_pages,
-            resolution=int(resolution),
-            tts_model=voice
-        ))
-
-        # ✅ Processing complete, remove status file
-        os.remove(status_file)
-        print("✅ Video Processing Completed!")
-    except Exception as e:
-        print(f"❌ Error during processing: {e}")
-        with open(status_file, "w") as f:
-            f.write("failed")
-
 # ✅ Home Route
 @app.route("/")
 def index():
@@ -99,15 +166,22 @@ def index():
 def signup():
     if request.method == "POST":
         email = request.form["email"]
-        password = bcrypt.generate_password_hash(request.form["password"]).decode("utf-8")
 
+        # Check first: don't spend a bcrypt hash on a taken address
         if User.query.filter_by(email=email).first():
             flash("⚠️ Email already registered!", "error")
             return redirect(url_for("signup"))
 
+        # Hash outside any transaction so concurrent signups don't hold the write lock meanwhile
+        password = hash_password(request.form["password"])
         new_user = User(email=email, password=password)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash("⚠️ Email already registered!", "error")
+            return redirect(url_for("signup"))
 
         flash("✅ Account created! Please log in.", "success")
         return redirect(url_for("login"))
@@ -125,7 +199,7 @@ def login():
         if email == admin_account and password == admin_password:
             user = User.query.filter_by(email=admin_account).first()
             if not user:
-                admin_hashed = bcrypt.generate_password_hash(admin_password).decode("utf-8")
+                admin_hashed = hash_password(admin_password)
                 user = User(email=admin_account, password=admin_hashed)
                 db.session.add(user)
                 db.session.commit()
@@ -139,6 +213,9 @@ def login():
         # ✅ Normal User Login
         user = User.query.filter_by(email=email).first()
         if user and bcrypt.check_password_hash(user.password, password):
+            if needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.commit()
             login_user(user)
             flash("✅ Logged in successfully!", "success")
             return redirect(url_for("index"))
@@ -160,6 +237,11 @@ def logout():
 @app.route("/process", methods=["POST"])
 @login_required
 def process_video():
+    # ✅ The session may predate a deletion: never create files or jobs for an account that is gone
+    if User.query.get(current_user.id) is None:
+        logout_user()
+        flash("⚠️ Your account no longer exists.", "error")
+        return redirect(url_for("index"))
     user_folder = os.path.join(app.config["OUTPUT_FOLDER"], str(current_user.id))
     os.makedirs(user_folder, exist_ok=True)
     
@@ -169,21 +251,142 @@ def process_video():
         resolution = request.form.get("resolution")
         num_of_pages = request.form.get('num_of_pages')
         voice          = request.form.get("voice")
+        # ✅ Optional extra renditions, encoded in the same pass as the main resolution
+        resolutions = [int(r) for r in request.form.getlist("extra_resolutions") if r.isdigit()]
+        hls = request.form.get("hls") == "on"
+        # ✅ Repeated / build-up pages: "off", "merge" or "reuse" (empty = server default)
+        dedup = request.form.get("dedup") or None
+        # ✅ Optional {slide index: script} edits; unchanged slides are reused from the last render
+        slide_overrides = request.form.get("slide_overrides")
     if not pdf_file:
         return jsonify({"status": "error", "message": "⚠️ Please upload a PDF file."}), 400
-    if video_file and video_file.filename != "":
-        video_path = os.path.join(user_folder, secure_filename(video_file.filename))
-        video_file.save(video_path)
-    else:
-        video_path = None
-        app.logger.info("No video file uploaded; proceeding without video.")
-    pdf_path = os.path.join(user_folder, secure_filename(pdf_file.filename))
-    pdf_file.save(pdf_path)
+    try:
+        slide_overrides = json.loads(slide_overrides) if slide_overrides else None
+        if slide_overrides is not None and not isinstance(slide_overrides, dict):
+            raise ValueError("not an object")
+    except ValueError:
+        return jsonify({"status": "error", "message": "⚠️ slide_overrides must be a JSON object."}), 400
+    # ✅ Uploads go to the content-addressed store (hashed while streaming; repeat uploads are deduplicated)
+    store = get_store()
+    owner = upload_owner(current_user.id, secrets.token_hex(8))
+    with metrics.stage("upload_save"):
+        if video_file and video_file.filename != "":
+            _, video_path = store.ingest(video_file.stream, video_file.filename, owner)
+            metrics.add_bytes("upload_save", os.path.getsize(video_path))
+        else:
+            video_path = None
+            app.logger.info("No video file uploaded; proceeding without video.")
+        _, pdf_path = store.ingest(pdf_file.stream, pdf_file.filename, owner)
+        metrics.add_bytes("upload_save", os.path.getsize(pdf_path))
 
-    processing_thread = threading.Thread(target=run_processing, args=(video_path, pdf_path, num_of_pages, resolution, user_folder, voice))
-    processing_thread.start()
+    # ✅ Scheduling cost = slides to generate (short decks are picked first)
+    cost = count_pages(pdf_path)
+    if num_of_pages and num_of_pages.strip().isdigit():
+        cost = min(cost, int(num_of_pages))
 
-    return jsonify({"status": "success", "message": "🚀 Processing started!"}), 200
+    try:
+        job_id = job_queue.enqueue(current_user.id, {
+            "video_path": video_path,
+            "pdf_path": pdf_path,
+            "num_of_pages": num_of_pages,
+            "resolution": resolution,
+            "user_folder": user_folder,
+            "voice": voice,
+            "slide_overrides": slide_overrides,
+            "resolutions": resolutions,
+            "hls": hls,
+            "dedup": dedup,
+            "upload_owner": owner,
+        }, cost=cost)
+    except QueueFullError as e:
+        store.release(owner)
+        return jsonify({"status": "error", "message": str(e)}), 429
+
+    return jsonify({"status": "success", "message": "🚀 Processing queued!", "job_id": job_id}), 200
+
+# ✅ Prometheus metrics (web process + every worker process)
+@app.route("/metrics")
+def metrics_endpoint():
+    counts = job_queue.counts()
+    for status in ("queued", "running"):
+        metrics.set_gauge(f"jobs_{status}", counts.get(status, 0))
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+# ✅ Job status as exposed to the browser
+def job_status(job):
+    progress = job["progress"] or {}
+    status = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": progress.get("stage"),
+        "done": progress.get("done"),
+        "total": progress.get("total"),
+        "eta_seconds": progress.get("eta_seconds"),
+        "error": job["error"],
+    }
+    if job["status"] == "queued":
+        status["queue_position"] = job_queue.queue_position(job["id"])
+    return status
+
+def get_own_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job["user_id"] != current_user.id:
+        return None
+    return job
+
+# ✅ Cheap JSON status (fallback for browsers without EventSource)
+@app.route("/jobs/<int:job_id>/status")
+@login_required
+def job_status_endpoint(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    return jsonify(job_status(job))
+
+# ✅ Server-Sent Events: pushes the job status whenever it changes
+#    (holds a request thread for up to SSE_MAX_SECONDS: needs threaded or async WSGI workers, see README)
+@app.route("/jobs/<int:job_id>/events")
+@login_required
+def job_events(job_id):
+    if get_own_job(job_id) is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+
+    def stream():
+        yield "retry: 3000\n\n"
+        last, last_sent = None, time.time()
+        deadline = time.time() + SSE_MAX_SECONDS
+        while time.time() < deadline:
+            job = job_queue.get(job_id)
+            if job is None:
+                return
+            payload = json.dumps(job_status(job))
+            if payload != last:
+                yield f"data: {payload}\n\n"
+                last, last_sent = payload, time.time()
+            elif time.time() - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            if job["status"] in ("done", "failed", "cancelled"):
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ✅ Finished videos per folder, re-listed only when the folder changes
+_video_listing = {}
+
+def list_videos(folder):
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    cached = _video_listing.get(folder)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, sorted(f for f in os.listdir(folder) if f.endswith(".mp4")))
+        _video_listing[folder] = cached
+    return cached[1]
 
 # ✅ Download Page (User Restricted)
 @app.route("/download")
@@ -191,37 +394,72 @@ def process_video():
 def download():
     user_folder = os.path.join(app.config["OUTPUT_FOLDER"], str(current_user.id), 'video')
 
-    # ✅ Check if processing is still ongoing
-    processing_file = os.path.join(user_folder, "processing.txt")
-    is_processing = os.path.exists(processing_file)
+    # ✅ Job state comes from the job queue; progress is then streamed to the page
+    job = job_queue.latest_for_user(current_user.id)
+    is_processing = job is not None and job["status"] in ("queued", "running")
+    failed_job = job if job is not None and job["status"] == "failed" else None
 
-    files = []
-    if os.path.exists(user_folder) and not is_processing:
-        files = [f for f in os.listdir(user_folder) if f.endswith(".mp4")]
+    files = [] if is_processing else list_videos(user_folder)
+    has_hls = bool(files) and os.path.isfile(os.path.join(user_folder, "hls", "master.m3u8"))
+    return render_template("download.html", files=files, is_processing=is_processing, has_hls=has_hls,
+                           job=job_status(job) if job else None, failed_job=failed_job)
 
-    return render_template("download.html", files=files, is_processing=is_processing)
+# ✅ Resolve a video of the current user (None if it does not exist)
+def user_video_path(filename):
+    secure_file = secure_filename((filename or "").strip())
+    if not secure_file:
+        return None
+    file_path = os.path.join(app.config["OUTPUT_FOLDER"], str(current_user.id), 'video', secure_file)
+    return file_path if os.path.isfile(file_path) else None
 
 # ✅ Secure File Download
 @app.route("/download/<filename>")
 @login_required
 def download_file(filename):
-    user_folder = os.path.join(app.config["OUTPUT_FOLDER"], str(current_user.id), 'video')
-
-    if not filename:
-        flash("⚠️ Invalid file request!", "error")
+    file_path = user_video_path(filename)
+    if file_path is None:
+        flash("⚠️ File not found!", "error")
         return redirect(url_for("download"))
+    # ✅ Range + conditional (ETag / Last-Modified): resumable downloads, 206 partial content
+    return send_file(file_path, mimetype="video/mp4", as_attachment=True, conditional=True, etag=True)
 
-    secure_file = secure_filename(filename.strip())
-    file_path = os.path.join(user_folder, secure_file)
-
-    print(f"📂 Looking for: {file_path}")
-    print(f"🛠️ File Exists: {os.path.exists(file_path)}")
-
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
-    else:
+# ✅ Inline Video Stream (Range requests let the player seek without downloading everything)
+@app.route("/stream/<filename>")
+@login_required
+def stream_file(filename):
+    file_path = user_video_path(filename)
+    if file_path is None:
+        return jsonify({"status": "error", "message": "File not found."}), 404
+    response = send_file(file_path, mimetype="video/mp4", conditional=True, etag=True, max_age=3600)
+    # ✅ Same URL for every user: only the browser may cache it, never a shared proxy / CDN
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+# ✅ HLS Ladder (master.m3u8 and <rendition>/index.m3u8 + segments, relative to each other)
+HLS_MIMETYPES = {".m3u8": "application/vnd.apple.mpegurl", ".m4s": "video/iso.segment", ".mp4": "video/mp4"}
+
+@app.route("/hls/<path:filename>")
+@login_required
+def stream_hls(filename):
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(filename)[1].lower())
+    if mimetype is None:
+        return jsonify({"status": "error", "message": "File not found."}), 404
+    hls_folder = os.path.join(app.config["OUTPUT_FOLDER"], str(current_user.id), 'video', 'hls')
+    # send_from_directory rejects paths outside hls_folder and answers 404 for missing files
+    response = send_from_directory(hls_folder, filename, mimetype=mimetype, conditional=True, max_age=3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+# ✅ In-Browser Preview Page
+@app.route("/preview/<filename>")
+@login_required
+def preview_file(filename):
+    if user_video_path(filename) is None:
         flash("⚠️ File not found!", "error")
         return redirect(url_for("download"))
+    return render_template("preview.html", filename=secure_filename(filename.strip()))
 
 # ✅ Delete File Endpoint (User Restricted)
 @app.route("/delete/<filename>", methods=["DELETE"])
@@ -232,6 +470,20 @@ def delete_file(filename):
         file_path = os.path.join(user_folder, secure_filename(filename))
         if os.path.exists(file_path):
             os.remove(file_path)
+            # The HLS ladder is repackaged from the MP4 renditions; it goes with any of them
+            hls_folder = os.path.join(user_folder, 'hls')
+            rendition = os.path.splitext(secure_filename(filename))[0].rsplit("_", 1)[-1]
+            if os.path.isdir(os.path.join(hls_folder, rendition)):
+                shutil.rmtree(hls_folder, ignore_errors=True)
+            # Frames, segments and slide audio only serve re-renders of these videos,
+            # unless a job is still building a new set
+            job = job_queue.latest_for_user(current_user.id)
+            idle = job is None or job["status"] not in ("queued", "running")
+            if idle and not any(f.endswith(".mp4") for f in os.listdir(user_folder)):
+                user_root = os.path.dirname(user_folder)
+                prune_render_sets([os.path.join(user_root, 'renders'), os.path.join(user_root, 'audio')])
+            # The uploads it was made from become evictable once no other video needs them
+            get_store().release(video_owner(current_user.id, secure_filename(filename)))
             return jsonify({"status": "success", "message": "File deleted successfully!"})
         else:
             return jsonify({"status": "error", "message": "File not found."}), 404
@@ -257,12 +509,17 @@ def admin_delete_user(token, user_id):
         return redirect(url_for("index"))
     user = User.query.get(user_id)
     if user:
+        # Stop the user's queued and running jobs before their files go away
+        job_queue.cancel_user_jobs(user.id, "The account was deleted.")
         # Delete the user's output folder if it exists
         user_folder = os.path.join(app.config["OUTPUT_FOLDER"], str(user.id))
         if os.path.exists(user_folder):
             shutil.rmtree(user_folder)
+        # Drop the user's uploads too, unless another user uploaded the same file
+        get_store().release_prefix(user_prefix(user.id), purge=True)
         db.session.delete(user)
         db.session.commit()
+        invalidate_user(user_id)
         flash("✅ User deleted successfully!", "success")
     else:
         flash("⚠️ User not found!", "error")
@@ -273,4 +530,9 @@ with app.app_context():
     db.create_all()
 
 if __name__ == "__main__":
+    # ✅ Start the bounded worker pool that drains the job queue
+    #    (imported here: web processes started by a WSGI server never load the processing engine)
+    from utility.worker import WorkerPool
+    worker_pool = WorkerPool(db_path=job_queue.db_path)
+    worker_pool.start()
     app.run(host="0.0.0.0", port=5001, debug=False, threaded=True)
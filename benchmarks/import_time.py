@@ -0,0 +1,146 @@
+"""
+Import-time benchmark for the web tier.
+
+Imports a module (app.py by default) in fresh interpreters and reports how
+long the import takes, the resulting RSS and the slowest imports, and
+fails if any processing-engine dependency (torch, Whisper, Pillow, ...)
+got loaded. Keeps the Flask processes small and quick to restart.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --max-seconds 1.5 --max-rss-mb 120
+    python -m benchmarks.import_time utility.worker --allow numpy
+
+Exits with status 1 when a forbidden module is imported or a budget is exceeded.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ✅ Only worker processes may load these
+FORBIDDEN = (
+    "torch", "whisper", "moviepy", "IPython", "nest_asyncio", "numpy", "PIL", "pdf2image",
+    "edge_tts", "google.genai", "api.whisper_LLM_api", "utility.worker", "utility.audio",
+)
+
+_MARKER = "-- import starts here --"
+_CHILD = """
+import sys, time, json, resource
+sys.stderr.write("{marker}\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": seconds, "rss": rss, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _rusage_mb(value):
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return value / (1024 * 1024) if sys.platform == "darwin" else value / 1024
+
+
+def parse_importtime(stderr):
+    """
+    Parses `python -X importtime` output.
+
+    :return: List of (cumulative seconds, module) for every import made by
+             the measured module, slowest first (a package's time includes
+             the imports it triggered).
+    """
+    entries = []
+    # Skip what the interpreter and the measuring code imported first
+    stderr = stderr.split(_MARKER, 1)[-1]
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(entries, reverse=True)
+
+
+def measure(module):
+    """Imports module once in a fresh interpreter started from the repository root."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.getenv("PYTHONPATH")])))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD.format(module=module, marker=_MARKER)],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{process.stderr[-2000:]}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    return {
+        "seconds": result["seconds"],
+        "rss_mb": _rusage_mb(result["rss"]),
+        "modules": result["modules"],
+        "slowest": parse_importtime(process.stderr),
+    }
+
+
+def forbidden_modules(modules, allow=()):
+    loaded = set(modules)
+    return sorted(
+        name for name in FORBIDDEN
+        if name not in allow and any(m == name or m.startswith(name + ".") for m in loaded)
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time and memory check for the web tier.")
+    parser.add_argument("module", nargs="?", default="app", help="Module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters; the median is reported")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument("--allow", action="append", default=[], help="Forbidden module to tolerate (repeatable)")
+    parser.add_argument("--max-seconds", type=float, help="Fail if the median import takes longer")
+    parser.add_argument("--max-rss-mb", type=float, help="Fail if the median RSS after import is larger")
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    runs = [measure(args.module) for _ in range(max(1, args.runs))]
+    runs.sort(key=lambda run: run["seconds"])
+    median = runs[len(runs) // 2]
+
+    problems = []
+    forbidden = forbidden_modules(median["modules"], args.allow)
+    if forbidden:
+        problems.append(f"imports worker-only modules: {', '.join(forbidden)}")
+    if args.max_seconds is not None and median["seconds"] > args.max_seconds:
+        problems.append(f"import took {median['seconds']:.3f}s (budget {args.max_seconds}s)")
+    if args.max_rss_mb is not None and median["rss_mb"] > args.max_rss_mb:
+        problems.append(f"RSS is {median['rss_mb']:.1f} MB (budget {args.max_rss_mb} MB)")
+
+    report = {
+        "module": args.module,
+        "python": sys.version.split()[0],
+        "runs": len(runs),
+        "seconds": round(median["seconds"], 4),
+        "seconds_min": round(runs[0]["seconds"], 4),
+        "rss_mb": round(median["rss_mb"], 1),
+        "module_count": len(median["modules"]),
+        "forbidden": forbidden,
+        "slowest": [{"module": name, "seconds": round(seconds, 4)} for seconds, name in median["slowest"][:args.top]],
+        "problems": problems,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    print(f"📊 import {args.module}: {report['seconds']}s, {report['rss_mb']} MB RSS, "
+          f"{report['module_count']} modules", file=sys.stderr)
+    for problem in problems:
+        print(f"❌ {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
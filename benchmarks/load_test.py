@@ -0,0 +1,159 @@
+"""
+Load test for the web tier's auth and download routes.
+
+Runs against a server that is already up (python app.py or a WSGI
+server). Every virtual user signs up once, then logs in and opens
+/download repeatedly, all users at the same time, the way a class does at
+the start of a lecture. Reports p50/p90/p99/max latency per route.
+
+    python -m benchmarks.load_test --base-url http://127.0.0.1:5001 --users 30 --rounds 5
+    python -m benchmarks.load_test --users 30 --max-p99 2.0     # exit 1 if a route's p99 is slower
+
+Only standard library is used; no extra packages are needed.
+"""
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import http.cookiejar
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time the request itself, not the page it redirects to."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values (q in 0..100)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * q // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self):
+        report = {}
+        for route, values in self.latencies.items():
+            report[route] = {
+                "requests": len(values),
+                "errors": self.errors.get(route, 0),
+                "p50": round(percentile(values, 50), 4),
+                "p90": round(percentile(values, 90), 4),
+                "p99": round(percentile(values, 99), 4),
+                "max": round(max(values), 4),
+            }
+        return report
+
+
+class VirtualUser:
+    def __init__(self, base_url, email, password, recorder, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.recorder = recorder
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, route, path, form=None, expect=(200, 302)):
+        data = urllib.parse.urlencode(form).encode("utf-8") if form is not None else None
+        start = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=data, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code  # 302 arrives here because redirects are not followed
+        except OSError:
+            status = None
+        self.recorder.add(route, time.perf_counter() - start, status in expect)
+        return status
+
+    def signup(self):
+        return self.request("signup", "/signup", {"email": self.email, "password": self.password})
+
+    def session(self, rounds):
+        for _ in range(rounds):
+            self.request("login", "/login", {"email": self.email, "password": self.password})
+            self.request("download", "/download", expect=(200,))
+            self.request("logout", "/logout")
+
+
+def run(base_url, users, rounds, timeout):
+    recorder = Recorder()
+    prefix = secrets.token_hex(4)
+    clients = [
+        VirtualUser(base_url, f"load-{prefix}-{i}@example.com", secrets.token_hex(8), recorder, timeout)
+        for i in range(users)
+    ]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(VirtualUser.signup, clients))
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(lambda client: client.session(rounds), clients))
+    elapsed = time.perf_counter() - start
+    total = sum(len(values) for values in recorder.latencies.values())
+    return {
+        "base_url": base_url,
+        "users": users,
+        "rounds": rounds,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1) if elapsed else None,
+        "routes": recorder.summary(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent login / download load test.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5001")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--rounds", type=int, default=3, help="Login + /download + logout cycles per user")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-p99", type=float, help="Fail if any route's p99 (seconds) is slower")
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args.base_url, args.users, args.rounds, args.timeout)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    failed = False
+    for route, stats in report["routes"].items():
+        print(f"📊 {route}: p50 {stats['p50']}s, p99 {stats['p99']}s, "
+              f"{stats['errors']}/{stats['requests']} errors", file=sys.stderr)
+        if stats["errors"] or (args.max_p99 is not None and stats["p99"] > args.max_p99):
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
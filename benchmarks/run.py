@@ -0,0 +1,263 @@
+"""
+Offline end-to-end benchmark of api.whisper_LLM_api.api.
+
+Gemini and edge-tts are replaced by local stub servers (benchmarks/stubs.py)
+and Whisper gets a synthetic recording, so runs need no network access and
+are comparable across machines and commits. Each deck runs in a fresh
+process with empty caches.
+
+    python -m benchmarks.run                                  # all decks in test_data/
+    python -m benchmarks.run --pages 5 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --pages 5 --baseline benchmarks/baseline.json
+
+Exits with status 1 when a metric regressed beyond --tolerance.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ✅ Regressions smaller than these are noise, whatever the relative change
+MIN_DELTA = {"seconds": 0.25, "mb": 10.0}
+
+
+def _rusage_mb(value):
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return value / (1024 * 1024) if sys.platform == "darwin" else value / 1024
+
+
+def stage_summary(spans):
+    """
+    Per stage: number of spans, busy time (sum of span durations) and wall
+    time (union of span intervals; overlapping slides are counted once).
+    """
+    stages = {}
+    for span in spans:
+        stages.setdefault(span["stage"], []).append((span["start"], span["start"] + span["duration"]))
+    summary = {}
+    for name, intervals in stages.items():
+        intervals.sort()
+        wall, end = 0.0, None
+        for lo, hi in intervals:
+            if end is None or lo > end:
+                wall += hi - lo
+                end = hi
+            elif hi > end:
+                wall += hi - end
+                end = hi
+        summary[name] = {
+            "count": len(intervals),
+            "busy_seconds": round(sum(hi - lo for lo, hi in intervals), 3),
+            "wall_seconds": round(wall, 3),
+        }
+    return summary
+
+
+def run_deck(pdf_path, work_dir, env, pages, resolution, recording):
+    """Runs one deck end to end. Called in a fresh spawned process."""
+    import resource
+
+    # Configuration is read at import time, so the environment goes first
+    os.environ.update(env)
+    sys.path.insert(0, REPO_ROOT)
+    import asyncio
+    from api.whisper_LLM_api import api
+    from utility import metrics
+    from utility import transcribe
+    from utility.video import get_encode_pool
+
+    user_folder = os.path.join(work_dir, "user")
+    os.makedirs(user_folder, exist_ok=True)
+    deck = shutil.copy(pdf_path, user_folder)
+    trace_path = os.path.join(work_dir, "trace.json")
+
+    start = time.perf_counter()
+    with metrics.job_trace(trace_path, pdf=os.path.basename(pdf_path)):
+        asyncio.run(api(
+            video_path=recording,
+            pdf_file_path=deck,
+            poppler_path=None,
+            output_audio_dir=os.path.join(user_folder, "audio"),
+            output_video_dir=os.path.join(user_folder, "video"),
+            output_text_path=os.path.join(user_folder, "text_output.txt"),
+            num_of_pages=pages,
+            resolution=resolution,
+            tts_model="en-US-KaiNeural",
+        ))
+    wall = time.perf_counter() - start
+
+    # ✅ Reap the pools so their CPU time and peak RSS show up in RUSAGE_CHILDREN
+    get_encode_pool().shutdown(wait=True)
+    if transcribe._transcribe_pool is not None:
+        transcribe._transcribe_pool.shutdown(wait=True)
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(trace_path, "r", encoding="utf-8") as f:
+        trace = json.load(f)
+    return {
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 3),
+        "cpu_seconds_main": round(own.ru_utime + own.ru_stime, 3),
+        "cpu_seconds_children": round(children.ru_utime + children.ru_stime, 3),
+        "peak_rss_mb": round(_rusage_mb(own.ru_maxrss), 1),
+        "peak_rss_children_mb": round(_rusage_mb(children.ru_maxrss), 1),
+        "stages": stage_summary(trace["spans"]),
+        "bytes": trace["bytes"],
+    }
+
+
+def _child(queue, *args):
+    try:
+        queue.put(("ok", run_deck(*args)))
+    except BaseException as e:
+        queue.put(("error", repr(e)))
+
+
+def run_isolated(*args):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child, args=(queue,) + args)
+    process.start()
+    status, result = queue.get()
+    process.join()
+    if status != "ok":
+        raise RuntimeError(result)
+    return result
+
+
+def median_run(runs):
+    """The run with the median wall time (keeps its stage breakdown consistent)."""
+    ordered = sorted(runs, key=lambda run: run["wall_seconds"])
+    return ordered[len(ordered) // 2]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Lists metrics that got worse than baseline by more than tolerance
+    (relative) and MIN_DELTA (absolute).
+    """
+    regressions = []
+
+    def check(deck, metric, current, previous, unit):
+        if previous is None or current is None:
+            return
+        if current > previous * (1 + tolerance) and current - previous > MIN_DELTA[unit]:
+            regressions.append({
+                "deck": deck, "metric": metric, "baseline": previous, "current": current,
+                "change": round(current / previous - 1, 3) if previous else None,
+            })
+
+    for deck, result in results.items():
+        before = baseline.get("decks", {}).get(deck)
+        if before is None:
+            continue
+        for metric in ("wall_seconds", "cpu_seconds"):
+            check(deck, metric, result[metric], before.get(metric), "seconds")
+        for metric in ("peak_rss_mb", "peak_rss_children_mb"):
+            check(deck, metric, result[metric], before.get(metric), "mb")
+        for stage, summary in result["stages"].items():
+            previous = before.get("stages", {}).get(stage, {}).get("wall_seconds")
+            check(deck, f"stages.{stage}.wall_seconds", summary["wall_seconds"], previous, "seconds")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark.")
+    parser.add_argument("decks", nargs="*", help="PDF files (default: test_data/*.pdf)")
+    parser.add_argument("--pages", default="all", help="Pages per deck ('all' or a number)")
+    parser.add_argument("--resolution", type=int, default=480)
+    parser.add_argument("--runs", type=int, default=1, help="Runs per deck; the median run is reported")
+    parser.add_argument("--audio-seconds", type=int, default=120, help="Length of the synthetic recording (0 = no recording)")
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--gemini-rpm", type=float, default=0, help="Per-key limit of the stub (0 = unlimited)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Fraction of random 429 answers")
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--keys", type=int, default=3, help="Number of fake API keys")
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="Compare against this results JSON")
+    parser.add_argument("--save-baseline", help="Also write the results to this path as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from benchmarks.stubs import gemini_stub, tts_stub, synthetic_recording
+
+    args = parse_args(argv)
+    decks = args.decks or sorted(glob.glob(os.path.join(REPO_ROOT, "test_data", "*.pdf")))
+    if not decks:
+        sys.exit("⚠️ No decks to benchmark.")
+
+    gemini = gemini_stub(latency=args.gemini_latency, rpm=args.gemini_rpm, error_rate=args.gemini_error_rate)
+    tts = tts_stub(latency=args.tts_latency)
+    print(f"🧪 Gemini stub at {gemini.url}, TTS stub at {tts.url}", file=sys.stderr)
+
+    root = tempfile.mkdtemp(prefix="svg-bench-")
+    try:
+        recording = None
+        if args.audio_seconds > 0:
+            recording = synthetic_recording(os.path.join(root, "recording.m4a"), args.audio_seconds)
+
+        results = {}
+        for deck in decks:
+            runs = []
+            for run in range(args.runs):
+                work_dir = os.path.join(root, f"run_{len(results)}_{run}")
+                env = {
+                    "GEMINI_BASE_URL": gemini.url,
+                    "TTS_ENDPOINT": f"{tts.url}/tts",
+                    "api_key": repr([f"bench-key-{i}" for i in range(args.keys)]),
+                    "CACHE_DIR": os.path.join(work_dir, "cache"),  # cold caches on every run
+                    "METRICS_DIR": os.path.join(work_dir, "metrics"),
+                    "ARTIFACT_DIR": os.path.join(work_dir, "artifacts"),  # no transcript reuse across runs
+                    "THREAD_COUNT": os.getenv("THREAD_COUNT", "1"),
+                }
+                print(f"⏱️ {os.path.basename(deck)} run {run + 1}/{args.runs}...", file=sys.stderr)
+                runs.append(run_isolated(deck, work_dir, env, args.pages, args.resolution, recording))
+            results[os.path.basename(deck)] = median_run(runs)
+    finally:
+        gemini.stop()
+        tts.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline")},
+        "stubs": {"gemini_requests": gemini.requests, "gemini_throttled": gemini.throttled, "tts_requests": tts.requests},
+        "decks": results,
+    }
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(results, json.load(f), args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    for deck, result in results.items():
+        print(f"📊 {deck}: {result['wall_seconds']}s wall, {result['cpu_seconds']}s CPU, "
+              f"{result['peak_rss_mb']} MB peak RSS", file=sys.stderr)
+    for regression in report.get("regressions", []):
+        print(f"❌ {regression['deck']} {regression['metric']}: "
+              f"{regression['baseline']} -> {regression['current']}", file=sys.stderr)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
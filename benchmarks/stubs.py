@@ -0,0 +1,187 @@
+import re
+import json
+import time
+import random
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ✅ Canned answers; one per slide so runs are deterministic
+CANNED_SCRIPT = "這張投影片說明了本節的重點，我們先看定義，再看一個簡單的例子，最後整理需要記住的地方。"
+_SLIDE_INDEX_RE = re.compile(r"【第 (\d+) 張 Ptt 內容】")
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_min):
+        self.capacity = rate_per_min
+        self.tokens = rate_per_min
+        self.rate = rate_per_min / 60.0
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Takes one token; returns 0 on success, otherwise seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _StubServer:
+    """Runs a ThreadingHTTPServer on 127.0.0.1 in a daemon thread."""
+
+    def __init__(self, handler, port=0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        handler.server_state = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, throttled=False):
+        with self._lock:
+            self.requests += 1
+            self.throttled += int(throttled)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+
+def gemini_stub(latency=0.5, jitter=0.2, rpm=0, error_rate=0.0, port=0):
+    """
+    Local stand-in for the Gemini REST API (generateContent).
+
+    :param latency: Mean response time in seconds.
+    :param rpm: Requests per minute allowed per API key (0 = unlimited);
+                extra requests get a 429 RESOURCE_EXHAUSTED with a retryDelay.
+    :param error_rate: Fraction of requests answered with a 429 regardless of rpm.
+    :return: Started server; point GEMINI_BASE_URL at its .url
+    """
+    buckets = {}
+    buckets_lock = threading.Lock()
+
+    class Handler(_QuietHandler):
+        def do_POST(self):
+            if ":generateContent" not in self.path:
+                self._send(404, b'{"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}}')
+                return
+            body = self._read_json()
+            key = self.headers.get("x-goog-api-key", "")
+
+            wait = 0.0
+            if rpm > 0:
+                with buckets_lock:
+                    wait = buckets.setdefault(key, _TokenBucket(rpm)).take()
+            if wait > 0 or random.random() < error_rate:
+                self.server_state.count(throttled=True)
+                error = {"error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (e.g. check quota).",
+                    "status": "RESOURCE_EXHAUSTED",
+                    "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                                 "retryDelay": f"{max(1, round(wait))}s"}],
+                }}
+                self._send(429, json.dumps(error).encode("utf-8"))
+                return
+
+            self.server_state.count()
+            time.sleep(max(0.0, random.gauss(latency, jitter)))
+            prompt = " ".join(
+                part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+            )
+            config = body.get("generationConfig") or {}
+            if config.get("responseMimeType") == "application/json":
+                # ✅ Batched request: one {index, script} per slide named in the prompt
+                indices = [int(i) for i in _SLIDE_INDEX_RE.findall(prompt)]
+                text = json.dumps([{"index": i, "script": CANNED_SCRIPT} for i in indices], ensure_ascii=False)
+            else:
+                text = CANNED_SCRIPT
+            response = {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": len(prompt) // 2, "candidatesTokenCount": len(text) // 2},
+            }
+            self._send(200, json.dumps(response, ensure_ascii=False).encode("utf-8"))
+
+    return _StubServer(Handler, port).start()
+
+
+def silent_mp3(seconds):
+    """Returns the bytes of an mp3 of `seconds` of near-silence (made with ffmpeg)."""
+    command = [
+        "ffmpeg", "-v", "error", "-f", "lavfi", "-i", f"anullsrc=r=24000:cl=mono:d={seconds}",
+        "-c:a", "libmp3lame", "-b:a", "48k", "-f", "mp3", "pipe:1",
+    ]
+    return subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+
+
+def tts_stub(latency=0.3, jitter=0.1, chars_per_second=6.0, port=0):
+    """
+    Local stand-in for edge-tts speaking the TTS_ENDPOINT protocol:
+    POST {"text", "voice", "rate"} -> mp3 bytes. The clip length follows
+    the text length so encode times stay realistic.
+
+    :return: Started server; point TTS_ENDPOINT at its .url + "/tts"
+    """
+    clips = {}
+    clips_lock = threading.Lock()
+
+    class Handler(_QuietHandler):
+        def do_POST(self):
+            body = self._read_json()
+            self.server_state.count()
+            seconds = min(60, max(1, round(len(body.get("text", "")) / chars_per_second)))
+            with clips_lock:
+                if seconds not in clips:
+                    clips[seconds] = silent_mp3(seconds)
+                data = clips[seconds]
+            time.sleep(max(0.0, random.gauss(latency, jitter)))
+            self._send(200, data, content_type="audio/mpeg")
+
+    return _StubServer(Handler, port).start()
+
+
+def synthetic_recording(output_path, seconds=120):
+    """
+    Writes a lecture-like test recording: a tone with background noise,
+    interrupted by a short pause every few seconds so chunked
+    transcription has places to split.
+    """
+    command = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=16000:duration={seconds}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.05:sample_rate=16000:duration={seconds}",
+        "-filter_complex", "[0][1]amix=inputs=2,volume='if(lt(mod(t,7),5.5),1,0)':eval=frame",
+        "-ac", "1", "-c:a", "aac", "-b:a", "64k", output_path,
+    ]
+    subprocess.run(command, check=True)
+    return output_path
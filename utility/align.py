@@ -0,0 +1,122 @@
+import os
+import re
+import zlib
+import numpy as np
+
+# ✅ Alignment configuration (override in .env)
+ALIGN_TRANSCRIPT = os.getenv("ALIGN_TRANSCRIPT", "1") == "1"
+ALIGN_CONTEXT_CHARS = int(os.getenv("ALIGN_CONTEXT_CHARS", "1500"))  # transcript budget per slide prompt
+HASH_DIMENSIONS = 4096
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff]+")
+
+
+def tokenize(text):
+    """Lower-cased words for latin text, character bigrams for CJK runs."""
+    text = (text or "").lower()
+    terms = _WORD_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def tfidf_matrix(documents, dimensions=HASH_DIMENSIONS):
+    """
+    Hashed TF-IDF vectors, one L2-normalised row per document. Hashing keeps
+    the matrix a fixed width no matter how large the vocabulary gets.
+    """
+    counts = np.zeros((len(documents), dimensions), dtype=np.float32)
+    for row, document in enumerate(documents):
+        for term in tokenize(document):
+            counts[row, zlib.crc32(term.encode("utf-8")) % dimensions] += 1
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    weights = np.log1p(counts) * idf
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return weights / norms
+
+
+def monotonic_assignment(similarity):
+    """
+    Assigns every transcript segment (rows) to a slide (columns) so that the
+    slide index never decreases along the talk, maximising total similarity.
+
+    :return: numpy array with the slide index of every segment.
+    """
+    n_segments, n_slides = similarity.shape
+    score = np.empty_like(similarity)
+    came_from = np.zeros((n_segments, n_slides), dtype=np.int64)
+    columns = np.arange(n_slides)
+    score[0] = similarity[0]
+    for i in range(1, n_segments):
+        # Best previous slide at or before each column (running max and its position)
+        best = np.maximum.accumulate(score[i - 1])
+        came_from[i] = np.maximum.accumulate(np.where(score[i - 1] == best, columns, 0))
+        score[i] = similarity[i] + best
+
+    assignment = np.zeros(n_segments, dtype=np.int64)
+    assignment[-1] = int(np.argmax(score[-1]))
+    for i in range(n_segments - 1, 0, -1):
+        assignment[i - 1] = came_from[i, assignment[i]]
+    return assignment
+
+
+def align_transcript(segments, slide_texts, context_chars=ALIGN_CONTEXT_CHARS):
+    """
+    Maps Whisper segments to slides and returns, for every slide, only the
+    part of the transcript that belongs to it (plus neighbouring segments
+    up to context_chars).
+
+    :param segments: Whisper segments, each with a "text" key, in time order.
+    :param slide_texts: Text of every slide, in order.
+    :return: List with one transcript window per slide.
+    """
+    segment_texts = [segment["text"].strip() for segment in segments if segment.get("text", "").strip()]
+    if not segment_texts or not slide_texts:
+        return [" ".join(segment_texts)[:context_chars]] * len(slide_texts)
+
+    vectors = tfidf_matrix(segment_texts + list(slide_texts))
+    similarity = vectors[:len(segment_texts)] @ vectors[len(segment_texts):].T
+    assignment = monotonic_assignment(similarity)
+
+    windows = []
+    for slide in range(len(slide_texts)):
+        owned = np.flatnonzero(assignment == slide)
+        if len(owned):
+            lo, hi = int(owned[0]), int(owned[-1])
+        else:
+            # ✅ No segment matched: centre the window where this slide falls in the talk
+            lo = hi = min(int(np.searchsorted(assignment, slide)), len(segment_texts) - 1)
+
+        chosen = list(range(lo, hi + 1))
+        length = sum(len(segment_texts[i]) for i in chosen)
+        # Owned segments first; if they exceed the budget keep the best-matching ones
+        if length > context_chars:
+            ranked = sorted(chosen, key=lambda i: -similarity[i, slide])
+            chosen, length = [], 0
+            for i in ranked:
+                if length + len(segment_texts[i]) > context_chars and chosen:
+                    break
+                chosen.append(i)
+                length += len(segment_texts[i])
+            chosen.sort()
+        else:
+            # Grow outwards with neighbouring segments while budget remains
+            before, after = lo - 1, hi + 1
+            while before >= 0 or after < len(segment_texts):
+                grew = False
+                for i in (before, after):
+                    if 0 <= i < len(segment_texts) and length + len(segment_texts[i]) <= context_chars:
+                        chosen.append(i)
+                        length += len(segment_texts[i])
+                        grew = True
+                before, after = before - 1, after + 1
+                if not grew:
+                    break
+            chosen.sort()
+        windows.append(" ".join(segment_texts[i] for i in chosen))
+    return windows
@@ -1,8 +1,4 @@
-from google import genai
 import edge_tts
-from tqdm import tqdm
-import time
-import itertools
 import os
 import torch
 import numpy as np
@@ -102,60 +98,6 @@ async def edge_tts_example(text, output_dir, filename, voice="en-US-KaiNeural"):
 
 
 
-def gemini_chat(text_array=None, script=None, clients=None, keys=None, max_retries=100):
-    if text_array is None or script is None:
-        raise ValueError("script or text_array can't be None")
-    
-    if (clients is None or len(clients) == 0) and (keys is None or len(keys) == 0):
-        raise ValueError("Either clients or keys must be provided")
-
-    # ✅ If only keys are provided, create clients
-    if clients is None or len(clients) == 0:
-        clients = [genai.Client(api_key=key) for key in keys]
-
-    # ✅ Ensure we have multiple clients to rotate
-    client_cycle = itertools.cycle(clients)
-
-    response_array_of_text = []
-    count = 0
-    for idx, text in enumerate(tqdm(text_array)):
-        retries = 0
-        client = next(client_cycle)  # Get the first client
-
-        while retries < max_retries:
-            try:
-                response = client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=textwrap.dedent(f'''\
-                    以下是我們的完整講稿：{script}  
-                    以下是第 {count} 張 Ptt 內容，前面幾張已經處理完畢：{text}  
-                    根據上述資料，並從中萃取與此張投影片直接相關的重點，生成一段針對該投影片的講稿，每段講稿儘量在 15 秒內講完。  
-                    要求如下：  
-                    1. 你是一位講者，用像人講話的方式方式。   
-                    2. 直接開始生成內容，不要開頭與、開場白，不要出現「好的」、「我們來看第幾張投影片」。
-                    '''),
-
-                )
-                response_array_of_text.append(remove_markdown(response.text))
-                count += 1
-                break  # ✅ Successful request; exit retry loop
-            except Exception as e:
-                error_message = str(e)
-                if "RESOURCE_EXHAUSTED" in error_message:
-                    wait_time = 2 ** retries  # Exponential backoff
-                    print(f"Rate limit reached for current client. Switching client and retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    retries += 1
-                    client = next(client_cycle)  # 🔄 Rotate to the next client
-                else:
-                    raise e  # ⚠️ Other errors should not be retried (e.g., invalid request)
-        else:
-            raise Exception("Max retries reached. Aborting.")
-    
-    return response_array_of_text
-
-
-
 '''\
 以下是我們的完整講稿：{script}  
 以下是第 {count} 張 Ptt 內容，前面幾張已經處理完畢：{text}  
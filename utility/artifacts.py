@@ -0,0 +1,273 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from utility import metrics
+
+# ✅ Upload store configuration (override in .env)
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+ARTIFACT_QUOTA_MB = int(os.getenv("ARTIFACT_QUOTA_MB", "20480"))  # unreferenced blobs are evicted beyond this
+CHUNK_SIZE = 1024 * 1024
+
+_SUFFIX_RE = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+
+def file_sha256(path):
+    """Streams a file through sha256 without loading it into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for uploaded files.
+
+    Each distinct file is kept once, as blobs/<sha[:2]>/<sha><suffix>, no
+    matter how many users upload it. Owners (strings such as
+    "user:3/video/output_video_480p.mp4") hold references to blobs. A blob
+    nobody references stays around as a cache for future uploads of the same
+    content until the store grows past quota_mb; then the least recently
+    used unreferenced blobs are deleted.
+
+    Bookkeeping lives in SQLite so the web process and every worker can
+    share one store.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, quota_mb=ARTIFACT_QUOTA_MB):
+        self.root = root
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self.db_path = os.path.join(root, "artifacts.db")
+        self._evict_lock = threading.Lock()
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha TEXT PRIMARY KEY,
+                    suffix TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS refs (
+                    owner TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    PRIMARY KEY (owner, sha)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_sha ON refs (sha)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def blob_path(self, sha, suffix=""):
+        return os.path.join(self.root, "blobs", sha[:2], sha + suffix)
+
+    def ingest(self, stream, filename, owner):
+        """
+        Writes an upload into the store, hashing it while it streams to disk.
+
+        If the content is already stored, the new copy is discarded and the
+        existing blob is reused. The owner's reference is added in the same
+        transaction, so the blob can't be evicted before anyone uses it.
+
+        :param stream: Binary file-like object (e.g. werkzeug FileStorage.stream).
+        :param filename: Original name; only its extension is kept.
+        :return: (sha256, path of the stored blob)
+        """
+        suffix = os.path.splitext(filename or "")[1].lower()
+        suffix = suffix if _SUFFIX_RE.match(suffix) else ""
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            sha = digest.hexdigest()
+
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT suffix FROM blobs WHERE sha = ?", (sha,)).fetchone()
+                now = time.time()
+                if row is not None and os.path.exists(self.blob_path(sha, row["suffix"])):
+                    suffix = row["suffix"]
+                    conn.execute("UPDATE blobs SET last_used = ? WHERE sha = ?", (now, sha))
+                    metrics.inc("artifact_dedup_total")
+                    metrics.inc("artifact_dedup_bytes_total", size)
+                else:
+                    path = self.blob_path(sha, suffix)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO blobs (sha, suffix, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                        (sha, suffix, size, now, now)
+                    )
+                conn.execute("INSERT OR IGNORE INTO refs (owner, sha) VALUES (?, ?)", (owner, sha))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.enforce_quota()
+        return sha, self.blob_path(sha, suffix)
+
+    def content_hash(self, path):
+        """sha256 of a file; free for blobs of this store (it is their name)."""
+        blobs_root = os.path.abspath(os.path.join(self.root, "blobs"))
+        if os.path.abspath(path).startswith(blobs_root + os.sep):
+            return os.path.splitext(os.path.basename(path))[0]
+        return file_sha256(path)
+
+    def shas_of(self, owner):
+        with self._connect() as conn:
+            return [row["sha"] for row in conn.execute("SELECT sha FROM refs WHERE owner = ?", (owner,))]
+
+    def add_refs(self, owner, shas):
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO refs (owner, sha) VALUES (?, ?)", [(owner, sha) for sha in shas])
+            conn.executemany("UPDATE blobs SET last_used = ? WHERE sha = ?", [(time.time(), sha) for sha in shas])
+
+    def replace_refs(self, owner, shas):
+        """Makes owner reference exactly shas (e.g. a re-rendered video made from new uploads)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM refs WHERE owner = ?", (owner,))
+            conn.executemany("INSERT OR IGNORE INTO refs (owner, sha) VALUES (?, ?)", [(owner, sha) for sha in shas])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def release(self, owner, purge=False):
+        """
+        Drops every reference held by owner.
+
+        :param purge: Also delete blobs nobody references anymore instead of
+                      keeping them as a dedup cache (e.g. when a user is deleted).
+        :return: The shas that were referenced.
+        """
+        return self._release("owner = ?", (owner,), purge)
+
+    def release_prefix(self, prefix, purge=False):
+        """Same as release() for every owner starting with prefix (e.g. "user:3/")."""
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return self._release("owner LIKE ? ESCAPE '\\'", (escaped + "%",), purge)
+
+    def _release(self, where, args, purge):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            shas = sorted({row["sha"] for row in conn.execute(f"SELECT sha FROM refs WHERE {where}", args)})
+            conn.execute(f"DELETE FROM refs WHERE {where}", args)
+            if purge:
+                for sha in shas:
+                    if conn.execute("SELECT 1 FROM refs WHERE sha = ? LIMIT 1", (sha,)).fetchone() is None:
+                        self._delete_blob(conn, sha)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return shas
+
+    def _delete_blob(self, conn, sha):
+        """Removes a blob row and its file (inside the caller's transaction). Returns its size."""
+        row = conn.execute("SELECT suffix, size FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        if row is None:
+            return 0
+        conn.execute("DELETE FROM blobs WHERE sha = ?", (sha,))
+        try:
+            os.remove(self.blob_path(sha, row["suffix"]))
+        except FileNotFoundError:
+            pass
+        return row["size"]
+
+    def usage(self):
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes,
+                       COALESCE(SUM(CASE WHEN sha IN (SELECT sha FROM refs) THEN size ELSE 0 END), 0) AS referenced_bytes
+                FROM blobs
+            """).fetchone()
+        return dict(row)
+
+    def enforce_quota(self):
+        """Deletes least recently used unreferenced blobs until the store fits its quota."""
+        with self._evict_lock:
+            conn = self._connect()
+            try:
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+                metrics.set_gauge("artifact_store_bytes", total)
+                if total <= self.quota_bytes:
+                    return 0
+                candidates = conn.execute("""
+                    SELECT sha FROM blobs
+                    WHERE sha NOT IN (SELECT sha FROM refs)
+                    ORDER BY last_used
+                """).fetchall()
+                evicted = 0
+                for row in candidates:
+                    if total <= self.quota_bytes:
+                        break
+                    conn.execute("BEGIN IMMEDIATE")
+                    # Re-check inside the transaction: an upload may have just referenced it
+                    still_free = conn.execute("SELECT 1 FROM refs WHERE sha = ? LIMIT 1", (row["sha"],)).fetchone() is None
+                    if still_free:
+                        total -= self._delete_blob(conn, row["sha"])
+                        evicted += 1
+                        metrics.inc("artifact_evictions_total")
+                    conn.execute("COMMIT")
+                if total > self.quota_bytes:
+                    print(f"⚠️ Upload store is over quota ({total // 2**20} MB) with only referenced files left.")
+                metrics.set_gauge("artifact_store_bytes", total)
+                return evicted
+            finally:
+                conn.close()
+
+
+# ✅ Reference owners. Uploads are held by their job until it finishes, then by the videos made from them.
+def user_prefix(user_id):
+    return f"user:{user_id}/"
+
+
+def upload_owner(user_id, token):
+    return f"user:{user_id}/upload/{token}"
+
+
+def video_owner(user_id, filename):
+    return f"user:{user_id}/video/{filename}"
+
+
+_store = None
+
+
+def get_store():
+    """Process-wide ArtifactStore (created on first use)."""
+    global _store
+    if _store is None:
+        _store = ArtifactStore()
+    return _store
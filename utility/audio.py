@@ -1,8 +1,114 @@
 import os
-import whisper
-from moviepy.editor import VideoFileClip
-import torch
+import tempfile
 import subprocess
+import numpy as np
+from utility import metrics
+from utility.model_registry import get_whisper_model, default_device
+from utility.transcribe import transcribe_chunked, TRANSCRIBE_MODE, CHUNKED_MIN_SECONDS
+from utility.scheduler import cpu_slot, get_cpu_slots
+from utility.cache import DiskCache, hash_key
+
+# ✅ Whisper expects 16 kHz mono float32 PCM
+SAMPLE_RATE = 16000
+PCM_MEMMAP_SECONDS = int(os.getenv("PCM_MEMMAP_SECONDS", "1800"))  # longer recordings go to a memory-mapped file
+PCM_CHUNK_BYTES = 1 << 20
+# ✅ torch threads (= CPU slots held) for one CPU transcription; the rest stay free for other jobs
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+
+# ✅ Transcripts keyed by recording content and model size (a re-uploaded recording is never transcribed twice)
+_transcript_cache = DiskCache("transcripts", max_mb=int(os.getenv("TRANSCRIPT_CACHE_MB", "256")))
+
+
+def probe_duration(input_file):
+    """Returns the media duration in seconds, or None if ffprobe can't tell."""
+    try:
+        output = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", input_file],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout
+        return float(output.strip())
+    except Exception:
+        return None
+
+
+def load_audio_pcm(input_file, sample_rate=SAMPLE_RATE, memmap_seconds=PCM_MEMMAP_SECONDS):
+    """
+    Decodes the audio track of a video straight into 16 kHz mono float32 PCM,
+    ready for model.transcribe, without writing an intermediate audio file.
+
+    Recordings longer than memmap_seconds are streamed into a memory-mapped
+    temp file instead of RAM. The caller deletes it with remove_pcm_file()
+    once the array is released (a mapped file can't be deleted on Windows).
+
+    :return: numpy float32 array (or memmap) of samples in [-1, 1].
+    """
+    command = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", input_file,
+        "-vn", "-map", "0:a:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "-loglevel", "error", "-",
+    ]
+    duration = probe_duration(input_file)
+
+    with metrics.stage("audio_extraction"):
+        if duration is None or duration <= memmap_seconds:
+            output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+            metrics.add_bytes("audio_extraction", len(output))
+            return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+
+        # ✅ Long recording: stream into a memory-mapped file chunk by chunk
+        capacity = int((duration + 1) * sample_rate)
+        fd, pcm_path = tempfile.mkstemp(suffix=".f32")
+        os.close(fd)
+        samples = np.memmap(pcm_path, dtype=np.float32, mode="w+", shape=(capacity,))
+
+        count = 0
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            leftover = b""
+            while True:
+                chunk = process.stdout.read(PCM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                chunk = leftover + chunk
+                usable = len(chunk) - len(chunk) % 2
+                leftover = chunk[usable:]
+                block = np.frombuffer(chunk[:usable], np.int16)
+                block = block[:capacity - count]
+                samples[count:count + len(block)] = block.astype(np.float32) / 32768.0
+                count += len(block)
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed to decode audio from {input_file}")
+        except BaseException:
+            del samples  # unmap before deleting
+            remove_pcm_file(pcm_path)
+            raise
+        metrics.add_bytes("audio_extraction", count * 2)
+        if count == 0:
+            # An empty slice no longer points at its file
+            del samples
+            remove_pcm_file(pcm_path)
+            return np.zeros(0, dtype=np.float32)
+        return samples[:count]
+
+
+def pcm_file(audio):
+    """Path of the temp file behind PCM from load_audio_pcm, or None if it is in RAM."""
+    return getattr(audio, "filename", None)
+
+
+def remove_pcm_file(pcm_path):
+    """Deletes a memory-mapped PCM file; drop every reference to its array first."""
+    if not pcm_path:
+        return
+    try:
+        os.remove(pcm_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"⚠️ Could not remove temporary audio {pcm_path}: {e}")
+
+
 def convert_mp4_to_mp3(input_file, output_file=None, bitrate="64k", sample_rate="32000"):
     if not output_file:
         output_file = os.path.splitext(input_file)[0] + ".mp3"
@@ -22,17 +128,66 @@ def convert_mp4_to_mp3(input_file, output_file=None, bitrate="64k", sample_rate=
         print(f"Error converting {input_file}: {e}")
         return None
 
-def transcribe_audio(audio_path, model_size="medium"):  # Load large Whisper model
-    if not os.path.exists(audio_path):
-        print(f"Error: File {audio_path} not found.")
+def use_chunked_transcription(audio, mode=TRANSCRIBE_MODE):
+    if isinstance(audio, str) or mode == "single":
+        return False
+    if mode == "chunked":
+        return True
+    # auto: long recordings on CPU-only machines
+    return default_device() == "cpu" and len(audio) / SAMPLE_RATE >= CHUNKED_MIN_SECONDS
+
+
+def transcribe_audio(audio, model_size="medium", mode=TRANSCRIBE_MODE, on_partial=None):  # Model is loaded once per worker process
+    """
+    :param audio: Path to an audio file, or 16 kHz float32 PCM from load_audio_pcm.
+    :param mode: "single", "chunked" (split at pauses, parallel processes) or "auto".
+    :param on_partial: Optional callback(text_so_far) for chunked transcription.
+    """
+    if isinstance(audio, str) and not os.path.exists(audio):
+        print(f"Error: File {audio} not found.")
         return
-    # Determine the device: use GPU if available, otherwise CPU.
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Loading Whisper model: {model_size} on {device}")
+    if use_chunked_transcription(audio, mode):
+        print("Start chunked transcribing...")
+        with metrics.stage("transcription", size=model_size, mode="chunked"):
+            result = transcribe_chunked(audio, model_size, SAMPLE_RATE, on_partial=on_partial)
+        print("Transcription:")
+        print(result.get("text", "No transcription available."))
+        return result
 
-    model = whisper.load_model(model_size).to(device)
+    # ✅ Shared per-process model (GPU if available, otherwise CPU)
+    model = get_whisper_model(model_size)
     print("Start transcribing...")
-    result = model.transcribe(audio_path)
+    with metrics.stage("transcription", size=model_size, mode="single"):
+        if default_device() == "cpu":
+            import torch
+
+            threads = min(WHISPER_CPU_THREADS, get_cpu_slots().size)
+            with cpu_slot("transcription", count=threads):
+                previous = torch.get_num_threads()
+                torch.set_num_threads(threads)
+                try:
+                    result = model.transcribe(audio)
+                finally:
+                    torch.set_num_threads(previous)
+        else:
+            result = model.transcribe(audio)
     print("Transcription:")
     print(result.get("text", "No transcription available."))
     return result
+
+
+def cached_transcript(content_sha, model_size):
+    """Returns the stored transcript of a recording, or None."""
+    return _transcript_cache.get_json(hash_key("whisper", content_sha, model_size))
+
+
+def save_transcript(content_sha, model_size, transcript):
+    """Stores the parts of a transcript the pipeline uses (text, timed segments, language)."""
+    _transcript_cache.set_json(hash_key("whisper", content_sha, model_size), {
+        "text": transcript.get("text", ""),
+        "segments": [
+            {"id": s.get("id", i), "start": float(s["start"]), "end": float(s["end"]), "text": s.get("text", "")}
+            for i, s in enumerate(transcript.get("segments", []))
+        ],
+        "language": transcript.get("language"),
+    })
@@ -0,0 +1,173 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from utility import metrics
+
+# ✅ Root folder for all on-disk caches (override in .env)
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+EVICT_LOW_WATER = 0.9  # eviction trims a full namespace to this share of max_mb, so it runs once per 10% of growth
+
+
+def hash_key(*parts):
+    """Builds a stable sha256 cache key from the given parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        else:
+            data = str(part).encode("utf-8")
+        # Length prefix keeps ("ab", "c") and ("a", "bc") apart
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed cache stored under CACHE_DIR/<namespace>.
+
+    Entries are plain files named after their key. Reading an entry refreshes
+    its mtime, and once the namespace grows past max_mb the least recently
+    used entries are deleted (in a background thread, down to EVICT_LOW_WATER
+    of max_mb). Several processes may share one cache folder:
+    writes go through a temp file and os.replace, so readers never see a
+    half-written entry.
+    """
+
+    def __init__(self, namespace, max_mb=1024, root=None):
+        self.namespace = namespace
+        self.root = os.path.join(root or CACHE_DIR, namespace)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # lazily measured, then tracked on writes
+        self._evicting = False
+        self._lock = threading.Lock()
+
+    def path(self, key, suffix=""):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("cache_hits_total" if hit else "cache_misses_total", cache=self.namespace)
+
+    def get_file(self, key, suffix=""):
+        """Returns the cached file path for key, or None."""
+        path = self.path(key, suffix)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # ✅ mark as recently used
+            except OSError:
+                pass
+            self._record(True)
+            return path
+        self._record(False)
+        return None
+
+    def put_file(self, key, src_path, suffix="", move=False):
+        """Stores a copy of src_path under key and returns the cached path."""
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        if move:
+            shutil.move(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        self._replace(tmp_path, path)
+        return path
+
+    def get_json(self, key):
+        """Returns the cached JSON value for key, or None."""
+        path = self.get_file(key, ".json")
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set_json(self, key, value):
+        path = self.path(key, ".json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        self._replace(tmp_path, path)
+        return path
+
+    def _replace(self, tmp_path, path):
+        """Moves a finished temp file into place and accounts for its size (minus the entry it replaces)."""
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        self._grow(os.path.getsize(path) - replaced)
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, full_path))
+        return entries
+
+    def _grow(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += nbytes
+            start = self._size > self.max_bytes and not self._evicting
+            if start:
+                self._evicting = True
+        if start:
+            # ✅ The walk over the namespace never runs on the caller's (often the event loop's) thread
+            threading.Thread(target=self._evict_in_background, daemon=True).start()
+
+    def _evict_in_background(self):
+        try:
+            self.evict()
+        except Exception as e:
+            print(f"⚠️ Cache eviction failed for {self.namespace}: {e}")
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits EVICT_LOW_WATER of max_bytes."""
+        target = self.max_bytes * EVICT_LOW_WATER
+        with self._lock:
+            tracked_before = self._size or 0
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, full_path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(full_path)
+                total -= size
+                metrics.inc("cache_evictions_total", cache=self.namespace)
+            except OSError:
+                pass
+        with self._lock:
+            # Re-sync with the disk (other processes write too), keeping writes made during the walk
+            self._size = total + (self._size or 0) - tracked_before
+
+    def stats(self):
+        return {"namespace": self.namespace, "hits": self.hits, "misses": self.misses}
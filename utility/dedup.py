@@ -0,0 +1,111 @@
+import os
+import re
+from collections import Counter
+import numpy as np
+from pdf2image import convert_from_path
+from utility import metrics
+from utility.cache import DiskCache, hash_key
+
+# ✅ Duplicate / build-up slide detection (override in .env)
+SLIDE_DEDUP = os.getenv("SLIDE_DEDUP", "off")                                   # off | merge | reuse
+DEDUP_HASH_DISTANCE = int(os.getenv("DEDUP_HASH_DISTANCE", "10"))               # max differing bits of 64
+DEDUP_TEXT_CONTAINMENT = float(os.getenv("DEDUP_TEXT_CONTAINMENT", "0.9"))      # share of the previous page's words kept
+DEDUP_MODES = ("off", "merge", "reuse")
+HASH_SIZE = 8
+THUMBNAIL_WIDTH = 64  # pages are hashed from tiny renders, independent of the output resolution
+
+_hash_cache = DiskCache("dhash", max_mb=16)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def dhash_arrays(gray):
+    """
+    Difference hashes of a stack of grayscale images, all at once.
+
+    :param gray: Array of shape (pages, HASH_SIZE, HASH_SIZE + 1).
+    :return: uint64 array with one 64-bit hash per page.
+    """
+    bits = gray[:, :, 1:] > gray[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(gray), -1), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+
+def hamming(a, b):
+    """Bitwise distance between two arrays of 64-bit hashes (elementwise)."""
+    diff = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def page_hashes(pdf_path, pdf_sha, page_count, poppler_path=None):
+    """
+    dHash of the first page_count pages, from thumbnails rendered by one
+    poppler call. Cached by document hash.
+    """
+    key = hash_key(pdf_sha, page_count, HASH_SIZE, THUMBNAIL_WIDTH)
+    cached = _hash_cache.get_json(key)
+    if cached is not None:
+        return np.array([int(h, 16) for h in cached], dtype=np.uint64)
+
+    from PIL import Image
+
+    thumbnails = convert_from_path(
+        pdf_path, poppler_path=poppler_path, first_page=1, last_page=page_count,
+        size=(THUMBNAIL_WIDTH, None), grayscale=True,
+    )
+    gray = np.stack([
+        np.asarray(page.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+        for page in thumbnails
+    ])
+    hashes = dhash_arrays(gray)
+    _hash_cache.set_json(key, [format(int(h), "016x") for h in hashes])
+    return hashes
+
+
+def text_containment(previous, current):
+    """Share of the previous page's words that are still on the current page (1.0 = all of them)."""
+    before = Counter(_WORD_RE.findall(previous.lower()))
+    after = Counter(_WORD_RE.findall(current.lower()))
+    if not before:
+        # Image-only pages: only the picture can tell them apart
+        return 1.0 if not after else 0.0
+    return sum((before & after).values()) / sum(before.values())
+
+
+def find_duplicate_runs(hashes, texts, max_distance=DEDUP_HASH_DISTANCE, min_containment=DEDUP_TEXT_CONTAINMENT):
+    """
+    Groups consecutive pages where each page repeats the previous one or
+    builds on it (looks almost the same and keeps its text, e.g. PowerPoint
+    animation steps exported as separate pages).
+
+    :return: List of (first, last) page indexes of runs with at least two pages.
+    """
+    if len(hashes) < 2:
+        return []
+    distances = hamming(hashes[:-1], hashes[1:])
+    runs = []
+    start = 0
+    for idx in range(1, len(hashes)):
+        follows = distances[idx - 1] <= max_distance and text_containment(texts[idx - 1], texts[idx]) >= min_containment
+        if not follows:
+            if idx - 1 > start:
+                runs.append((start, idx - 1))
+            start = idx
+    if len(hashes) - 1 > start:
+        runs.append((start, len(hashes) - 1))
+    return runs
+
+
+def detect_duplicates(pdf_path, pdf_sha, texts, poppler_path=None):
+    """
+    :param texts: Text of the pages to check (their count limits the pages hashed).
+    :return: List of (first, last) runs, see find_duplicate_runs().
+    """
+    with metrics.stage("dedup"):
+        hashes = page_hashes(pdf_path, pdf_sha, len(texts), poppler_path)
+        runs = find_duplicate_runs(hashes, texts)
+    redundant = sum(last - first for first, last in runs)
+    if redundant:
+        metrics.inc("slides_deduplicated_total", redundant)
+        print(f"🪞 Found {redundant} repeated or build-up page(s) in {len(runs)} group(s): "
+              + ", ".join(f"{first + 1}-{last + 1}" for first, last in runs))
+    return runs
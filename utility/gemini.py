@@ -0,0 +1,322 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import textwrap
+from google import genai
+from utility import metrics
+from utility.cache import DiskCache, hash_key
+from utility.text import remove_markdown
+
+# ✅ Gemini configuration (override in .env). Limits are per API key.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))            # requests per minute per key
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))       # input tokens per minute per key
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "0"))  # 0 = two in-flight requests per key
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "10"))
+GEMINI_MAX_BACKOFF = float(os.getenv("GEMINI_MAX_BACKOFF", "60"))
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "1"))  # slides per request (1 = one request per slide)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")           # optional local stand-in, e.g. http://127.0.0.1:8766
+
+# ✅ Bump whenever build_slide_prompt changes so cached scripts are not reused
+PROMPT_VERSION = "2"
+_script_cache = DiskCache("scripts", max_mb=int(os.getenv("SCRIPT_CACHE_MB", "256")))
+
+_RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def build_slide_prompt(script, text, idx):
+    return textwrap.dedent(f'''\
+    以下是與此張投影片相關的講稿內容：{script}
+    以下是第 {idx} 張 Ptt 內容，前面幾張已經處理完畢：{text}
+    根據上述資料，並從中萃取與此張投影片直接相關的重點，生成一段針對該投影片的講稿，每段講稿儘量在 15 秒內講完。
+    要求如下：
+    1. 你是一位講者，用像人講話的方式方式。
+    2. 直接開始生成內容，不要開頭與、開場白，不要出現「好的」、「我們來看第幾張投影片」。
+    ''')
+
+
+def build_batch_prompt(slides):
+    """
+    One prompt for several consecutive slides. slides is a list of
+    (idx, text, script); the transcript is included once when every slide
+    shares it, otherwise next to each slide.
+    """
+    shared = len({script for _, _, script in slides}) == 1
+    parts = []
+    if shared:
+        parts.append(f"以下是與這些投影片相關的講稿內容：{slides[0][2]}")
+    for idx, text, script in slides:
+        if shared:
+            parts.append(f"【第 {idx} 張 Ptt 內容】{text}")
+        else:
+            parts.append(f"【第 {idx} 張 Ptt 內容】{text}\n【第 {idx} 張相關講稿】{script}")
+    parts.append(textwrap.dedent('''\
+    根據上述資料，為每一張投影片分別萃取直接相關的重點，生成一段針對該投影片的講稿，每段講稿儘量在 15 秒內講完。
+    要求如下：
+    1. 你是一位講者，用像人講話的方式方式。
+    2. 直接開始生成內容，不要開頭與、開場白，不要出現「好的」、「我們來看第幾張投影片」。
+    3. 以 JSON 陣列回覆，每個元素包含 index（投影片編號）與 script（講稿）。
+    '''))
+    return "\n".join(parts)
+
+
+# ✅ Structured output: one {index, script} object per requested slide
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "index": {"type": "INTEGER"},
+            "script": {"type": "STRING"},
+        },
+        "required": ["index", "script"],
+    },
+}
+
+
+def parse_batch_response(raw, expected):
+    """
+    Validates a batched JSON response and returns {idx: script} for every
+    well-formed entry whose index was requested. Missing or malformed
+    entries are simply absent so the caller can fall back for them.
+    """
+    try:
+        items = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(items, list):
+        return {}
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        idx, script = item.get("index"), item.get("script")
+        if isinstance(idx, int) and idx in expected and isinstance(script, str) and script.strip():
+            results[idx] = remove_markdown(script)
+    return results
+
+
+def script_cache_key(script, text, idx):
+    return hash_key(GEMINI_MODEL, PROMPT_VERSION, script, text, idx)
+
+
+def estimate_tokens(text):
+    """Rough input token count: one per CJK character, one per 4 other characters."""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def is_rate_limited(error):
+    message = str(error)
+    return "RESOURCE_EXHAUSTED" in message or getattr(error, "code", None) == 429
+
+
+def retry_after(error):
+    """Returns the server-suggested retry delay in seconds, if the error carries one."""
+    match = _RETRY_DELAY_RE.search(str(error))
+    return float(match.group(1)) if match else 0.0
+
+
+def backoff_delay(attempt, suggested=0.0, cap=GEMINI_MAX_BACKOFF):
+    """Full-jitter exponential backoff, never shorter than the server's retry-after."""
+    return max(suggested, random.uniform(0, min(cap, 2 ** attempt)))
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_min; holds at most one minute of budget."""
+
+    def __init__(self, rate_per_min):
+        self.capacity = rate_per_min
+        self.tokens = rate_per_min
+        self.rate = rate_per_min / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class KeyState:
+    def __init__(self, index, client, rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+        self.index = index
+        self.client = client
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+
+    def wait_time(self, tokens, now):
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+        )
+
+
+class KeyPool:
+    """
+    Hands out API keys for requests, respecting each key's request and token
+    budget. Keys that were throttled by the server are skipped until their
+    backoff expires; when every key is busy the caller sleeps (asynchronously)
+    until the earliest one frees up.
+    """
+
+    def __init__(self, clients, rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+        self.keys = [KeyState(i, client, rpm, tpm) for i, client in enumerate(clients)]
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                # Prefer the key that is free soonest, then the one with the most budget left
+                waits = [(key.wait_time(tokens, now), -key.requests.tokens, key.index) for key in self.keys]
+                wait, _, index = min(waits)
+                if wait <= 0:
+                    key = self.keys[index]
+                    key.requests.consume(1, now)
+                    key.tokens.consume(tokens, now)
+                    return key
+            metrics.inc("gemini_key_wait_total")
+            await asyncio.sleep(wait + random.uniform(0, 0.1))
+
+    def throttle(self, key, delay):
+        key.blocked_until = max(key.blocked_until, time.monotonic() + delay)
+
+
+async def request_content(pool, prompt, max_retries=GEMINI_MAX_RETRIES, config=None):
+    """Sends one request, rotating keys and backing off on throttling. Returns the raw text."""
+    tokens = estimate_tokens(prompt)
+    for attempt in range(max_retries):
+        key = await pool.acquire(tokens)
+        try:
+            with metrics.timer("gemini_request_seconds"):
+                response = await key.client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=prompt,
+                    config=config,
+                )
+            return response.text
+        except Exception as e:
+            if not is_rate_limited(e):
+                raise  # ⚠️ Other errors should not be retried (e.g., invalid request)
+            delay = backoff_delay(attempt, retry_after(e))
+            metrics.inc("gemini_throttled_total", key=str(key.index))
+            print(f"Rate limit reached for key #{key.index}. Routing around it for {delay:.1f} seconds...")
+            pool.throttle(key, delay)
+    raise Exception("Max retries reached. Aborting.")
+
+
+async def generate_slide(pool, prompt, max_retries=GEMINI_MAX_RETRIES):
+    """Generates one slide script."""
+    return remove_markdown(await request_content(pool, prompt, max_retries))
+
+
+class SlideScriptGenerator:
+    """
+    Generates slide scripts one at a time while sharing a key pool and an
+    in-flight limit, so callers can request slides as they need them.
+    Every request consults the script cache first.
+
+    With batch_size K > 1, the first request for a slide asks for all
+    registered slides in its block of K consecutive slides in one
+    structured (JSON) request. Slides that come back missing or malformed
+    fall back to a normal per-slide request.
+    """
+
+    def __init__(self, script, clients=None, keys=None,
+                 max_retries=GEMINI_MAX_RETRIES, concurrency=GEMINI_CONCURRENCY,
+                 batch_size=GEMINI_BATCH_SIZE):
+        if script is None:
+            raise ValueError("script can't be None")
+
+        if (clients is None or len(clients) == 0) and (keys is None or len(keys) == 0):
+            raise ValueError("Either clients or keys must be provided")
+
+        # ✅ If only keys are provided, create clients
+        if clients is None or len(clients) == 0:
+            http_options = {"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
+            clients = [genai.Client(api_key=key, http_options=http_options) for key in keys]
+
+        self.script = script
+        self.max_retries = max_retries
+        self.pool = KeyPool(clients)
+        self.semaphore = asyncio.Semaphore(concurrency or 2 * len(clients))
+        self.batch_size = max(1, batch_size)
+        self._slides = {}   # idx -> (text, script) known for batching
+        self._batches = {}  # block number -> task resolving to {idx: script}
+
+    def register(self, slides):
+        """Announces (idx, text, script) of slides that will be requested, so batches can include them."""
+        for idx, text, script in slides:
+            self._slides[idx] = (text, self.script if script is None else script)
+
+    async def _generate_batch(self, block):
+        members = []
+        for idx in range(block * self.batch_size, (block + 1) * self.batch_size):
+            if idx not in self._slides:
+                continue
+            text, script = self._slides[idx]
+            if _script_cache.get_json(script_cache_key(script, text, idx)) is None:
+                members.append((idx, text, script))
+        if len(members) < 2:
+            return {}  # nothing to gain, use the per-slide request
+
+        try:
+            async with self.semaphore:
+                raw = await request_content(
+                    self.pool, build_batch_prompt(members), self.max_retries,
+                    config={"response_mime_type": "application/json", "response_schema": BATCH_RESPONSE_SCHEMA},
+                )
+        except Exception as e:
+            print(f"⚠️ Batched request for slides {members[0][0]}-{members[-1][0]} failed, falling back: {e}")
+            return {}
+
+        results = parse_batch_response(raw, {idx for idx, _, _ in members})
+        metrics.inc("gemini_batch_slides_total", len(results))
+        for idx, text, script in members:
+            if idx in results:
+                _script_cache.set_json(script_cache_key(script, text, idx), {"text": results[idx]})
+        return results
+
+    async def generate(self, idx, text, script=None):
+        """
+        :param script: Transcript window for this slide; defaults to the
+                       transcript the generator was created with.
+        """
+        script = self.script if script is None else script
+        # ✅ Identical prompt inputs -> reuse the stored script, no API call
+        cache_key = script_cache_key(script, text, idx)
+        cached = _script_cache.get_json(cache_key)
+        if cached is not None:
+            return cached["text"]
+
+        if self.batch_size > 1:
+            self._slides.setdefault(idx, (text, script))
+            block = idx // self.batch_size
+            if block not in self._batches:
+                self._batches[block] = asyncio.ensure_future(self._generate_batch(block))
+            results = await self._batches[block]
+            if idx in results:
+                return results[idx]
+            metrics.inc("gemini_batch_fallback_total")
+
+        async with self.semaphore:
+            result = await generate_slide(self.pool, build_slide_prompt(script, text, idx), self.max_retries)
+        _script_cache.set_json(cache_key, {"text": result})
+        return result
@@ -0,0 +1,360 @@
+import os
+import json
+import math
+import time
+import sqlite3
+
+# ✅ Queue configuration (override in .env)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("instance", "jobs.db"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "50"))          # admission limit for the whole server
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "3"))       # queued + running jobs per user
+MAX_RUNNING_PER_USER = int(os.getenv("MAX_RUNNING_PER_USER", "1")) # jobs of one user running at once
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", "2"))         # runs per job (after a crash or a failure)
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "30"))        # seconds before a failed job runs again (x attempts)
+PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "60"))  # waiting this long = half the cost
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))    # a running job without a heartbeat this long is recovered
+
+# ✅ Lower runs first: small jobs jump ahead, but every job gains priority while it waits.
+#    Cost counts on a log scale, so a deck of N slides waits at most
+#    PRIORITY_AGING_SECONDS * log2((N + 1) / 2) longer than a one-slide job
+#    submitted at the same time (200 slides: ~6.6 minutes with the default).
+_PRIORITY = f"(cost_weight(cost) + created_at / {PRIORITY_AGING_SECONDS!r})"
+
+
+def cost_weight(cost):
+    """Scheduling weight of a job's cost: doubling the cost adds one unit."""
+    return math.log2(1 + max(cost or 0, 0))
+
+
+class QueueFullError(Exception):
+    """Raised when a job is rejected by admission control."""
+
+
+class JobCancelled(Exception):
+    """
+    Raised in the worker when its running job is no longer its own: it was
+    cancelled (its user was deleted) or its lease expired and it went back
+    to the queue.
+    """
+
+
+class JobQueue:
+    """
+    Persistent job queue stored in SQLite.
+
+    Jobs move through queued -> running -> done / failed (or cancelled). Every state change
+    happens inside an IMMEDIATE transaction so several worker processes can
+    claim jobs from the same database without handing one job out twice.
+
+    A running job is leased to the worker that claimed it: the worker
+    refreshes heartbeat_at while it works, and a job without a heartbeat
+    for JOB_LEASE_SECONDS counts as abandoned. Updates from a worker carry
+    the attempt number it claimed, so a worker whose lease was taken over
+    can no longer change the job.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    params TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_pid INTEGER,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    progress TEXT,
+                    cost REAL NOT NULL DEFAULT 0,
+                    available_at REAL,
+                    heartbeat_at REAL
+                )
+            """)
+            # ✅ Add columns missing from databases created by older versions
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in (("progress", "TEXT"), ("cost", "REAL NOT NULL DEFAULT 0"), ("available_at", "REAL"), ("heartbeat_at", "REAL")):
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, id)")
+
+    def _connect(self):
+        # isolation_level=None -> we issue BEGIN/COMMIT ourselves
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("cost_weight", 1, cost_weight, deterministic=True)
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["progress"] = json.loads(job["progress"]) if job.get("progress") else None
+        return job
+
+    def enqueue(self, user_id, params, cost=0):
+        """
+        Adds a job to the queue after checking admission limits.
+
+        :param user_id: Owner of the job.
+        :param params: JSON-serialisable keyword arguments for the worker.
+        :param cost: Expected size of the job (e.g. number of slides); cheaper jobs start first.
+        :return: The new job id.
+        :raises QueueFullError: If the server or the user has too many pending jobs.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+            if active >= MAX_QUEUED_JOBS:
+                raise QueueFullError("⚠️ The server is busy. Please try again in a few minutes.")
+
+            user_active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')",
+                (user_id,)
+            ).fetchone()[0]
+            if user_active >= MAX_JOBS_PER_USER:
+                raise QueueFullError(f"⚠️ You already have {user_active} jobs in progress. Please wait for them to finish.")
+
+            cursor = conn.execute(
+                "INSERT INTO jobs (user_id, status, params, created_at, cost) VALUES (?, 'queued', ?, ?, ?)",
+                (user_id, json.dumps(params), time.time(), cost)
+            )
+            conn.execute("COMMIT")
+            return cursor.lastrowid
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker_pid):
+        """
+        Atomically picks the next queued job and marks it as running.
+
+        Fair share first: jobs of users with fewer running jobs go ahead
+        (and users at MAX_RUNNING_PER_USER are skipped). Among those, the
+        lowest log2 of the cost wins, aged by PRIORITY_AGING_SECONDS so large
+        jobs are never starved (see _PRIORITY for the worst-case wait).
+
+        :return: The job as a dict, or None if nothing can be started.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(f"""
+                SELECT jobs.* FROM jobs
+                LEFT JOIN (
+                    SELECT user_id, COUNT(*) AS running FROM jobs WHERE status = 'running' GROUP BY user_id
+                ) AS busy ON busy.user_id = jobs.user_id
+                WHERE jobs.status = 'queued' AND COALESCE(busy.running, 0) < ?
+                  AND COALESCE(jobs.available_at, 0) <= ?
+                ORDER BY COALESCE(busy.running, 0), {_PRIORITY}, jobs.id
+                LIMIT 1
+            """, (MAX_RUNNING_PER_USER, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1, progress = NULL WHERE id = ?",
+                (worker_pid, now, now, row["id"])
+            )
+            conn.execute("COMMIT")
+            job = self._to_dict(row)
+            job["status"] = "running"
+            job["attempts"] += 1
+            job["progress"] = None
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _owned(attempt):
+        """WHERE clause (and its arguments) matching a job still running the given attempt."""
+        if attempt is None:
+            return "status = 'running'", ()
+        return "status = 'running' AND attempts = ?", (attempt,)
+
+    def complete(self, job_id, attempt=None):
+        """
+        :param attempt: The attempt number the worker claimed (None = any).
+        :return: False if the job is no longer this attempt's (cancelled or recovered meanwhile).
+        """
+        owned, args = self._owned(attempt)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = 'done', finished_at = ?, error = NULL WHERE id = ? AND {owned}",
+                (time.time(), job_id, *args)
+            )
+            return cursor.rowcount > 0
+
+    def heartbeat(self, job_id, attempt=None):
+        """Renews the worker's lease on a running job. :return: False if the job is no longer its own."""
+        owned, args = self._owned(attempt)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND {owned}", (time.time(), job_id, *args)
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job_id, error, retry=False, attempt=None):
+        """
+        Marks the job as failed. With retry=True a job that has attempts left
+        goes back to the queue instead and runs again after JOB_RETRY_DELAY
+        times its attempts (it resumes from its checkpoint).
+
+        :return: True if the job was put back in the queue.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT attempts, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] != "running" or attempt not in (None, row["attempts"]):
+                # Cancelled or recovered while it ran: leave it alone
+                conn.execute("COMMIT")
+                return False
+            now = time.time()
+            requeue = retry and row["attempts"] < MAX_JOB_ATTEMPTS
+            if requeue:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker_pid = NULL, started_at = NULL, error = ?, available_at = ? WHERE id = ?",
+                    (str(error), now + JOB_RETRY_DELAY * row["attempts"], job_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                    (now, str(error), job_id)
+                )
+            conn.execute("COMMIT")
+            return requeue
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def set_progress(self, job_id, progress, attempt=None):
+        """
+        Stores the job's latest progress (a JSON-serialisable dict).
+
+        :return: False if the job is no longer this attempt's (e.g. it was cancelled).
+        """
+        owned, args = self._owned(attempt)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ? AND {owned}",
+                (json.dumps(progress), time.time(), job_id, *args)
+            )
+            return cursor.rowcount > 0
+
+    def cancel_user_jobs(self, user_id, reason="The account was deleted."):
+        """
+        Cancels every queued or running job of the user, whose account is being
+        deleted. Running jobs notice it at their next progress update, stop
+        and remove the user's output folder they were writing to.
+
+        :return: The cancelled jobs (as dicts, with the status they had before).
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')", (user_id,)
+            ).fetchall()
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, error = ? WHERE user_id = ? AND status IN ('queued', 'running')",
+                (time.time(), reason, user_id)
+            )
+            conn.execute("COMMIT")
+            return [self._to_dict(row) for row in rows]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            return self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def latest_for_user(self, user_id):
+        """The user's most recent job, or None."""
+        with self._connect() as conn:
+            return self._to_dict(conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)
+            ).fetchone())
+
+    def queue_position(self, job_id):
+        """Approximate number of queued jobs ahead of job_id (by priority, ignoring fair share)."""
+        with self._connect() as conn:
+            return conn.execute(f"""
+                SELECT COUNT(*) FROM jobs, (SELECT {_PRIORITY} AS priority, id FROM jobs WHERE id = ?) AS own
+                WHERE jobs.status = 'queued' AND jobs.id != own.id
+                  AND ({_PRIORITY} < own.priority OR ({_PRIORITY} = own.priority AND jobs.id < own.id))
+            """, (job_id,)).fetchone()[0]
+
+    def counts(self):
+        """Number of jobs per status, e.g. {"queued": 3, "running": 2}."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def recover(self, dead_pids=()):
+        """
+        Puts jobs whose lease expired (no heartbeat for JOB_LEASE_SECONDS)
+        back in the queue, or fails them once they have used up
+        MAX_JOB_ATTEMPTS.
+
+        :param dead_pids: Pids of workers known to have exited; their jobs are
+                          recovered right away instead of when the lease runs out.
+        :return: The recovered jobs as dicts; "status" is their new status
+                 ("queued" or "failed").
+        """
+        dead_pids = list(dead_pids)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            rows = conn.execute(f"""
+                SELECT * FROM jobs WHERE status = 'running'
+                  AND (COALESCE(heartbeat_at, started_at, 0) < ? OR worker_pid IN ({",".join("?" * len(dead_pids)) or "NULL"}))
+            """, (now - JOB_LEASE_SECONDS, *dead_pids)).fetchall()
+            recovered = []
+            for row in rows:
+                job = self._to_dict(row)
+                if row["attempts"] >= MAX_JOB_ATTEMPTS:
+                    job["status"] = "failed"
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                        (now, "Worker stopped while processing this job.", row["id"])
+                    )
+                else:
+                    job["status"] = "queued"
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker_pid = NULL, started_at = NULL, heartbeat_at = NULL WHERE id = ?",
+                        (row["id"],)
+                    )
+                recovered.append(job)
+            conn.execute("COMMIT")
+            return recovered
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
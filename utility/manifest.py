@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+
+class SlideManifest:
+    """
+    Per-render record of every slide's artifacts (script text, audio, frame,
+    encoded segment) together with a hash of the inputs each one was built
+    from. A later render only rebuilds the artifacts whose input hash changed
+    or whose file has disappeared.
+
+    Layout of manifest.json:
+        {"slides": {"0": {"text": {"hash": ..., "value": ...},
+                          "audio": {"hash": ..., "path": ...}, ...}}}
+    """
+
+    def __init__(self, path, autosave_interval=None):
+        """
+        :param autosave_interval: If set, changes are written to disk at most
+                                  this many seconds apart, so a render that
+                                  crashes can resume from the last checkpoint.
+        """
+        self.path = path
+        self.autosave_interval = autosave_interval
+        self._last_saved = time.monotonic()
+        self._lock = threading.Lock()
+        self.data = {"slides": {}}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                print(f"⚠️ Ignoring unreadable manifest: {path}")
+
+    def lookup(self, idx, kind, input_hash):
+        """
+        Returns the stored entry if it was built from the same inputs and its
+        file (if any) still exists, otherwise None.
+        """
+        entry = self.data["slides"].get(str(idx), {}).get(kind)
+        if not entry or entry.get("hash") != input_hash:
+            return None
+        if "path" in entry and not os.path.exists(entry["path"]):
+            return None
+        return entry
+
+    def record(self, idx, kind, input_hash, path=None, value=None):
+        entry = {"hash": input_hash}
+        if path is not None:
+            entry["path"] = path
+        if value is not None:
+            entry["value"] = value
+        with self._lock:
+            self.data["slides"].setdefault(str(idx), {})[kind] = entry
+        self._autosave()
+        return entry
+
+    def forget(self, idx, kind):
+        with self._lock:
+            self.data["slides"].get(str(idx), {}).pop(kind, None)
+        self._autosave()
+
+    def _autosave(self):
+        if self.autosave_interval is not None and time.monotonic() - self._last_saved >= self.autosave_interval:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            payload = json.dumps(self.data, ensure_ascii=False, indent=1)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+        self._last_saved = time.monotonic()
+
+
+def prune_render_sets(parent_dirs, keep=None):
+    """
+    Deletes per-deck working sets (frames, segments, slide audio and their
+    manifest), one folder per deck in each of parent_dirs.
+
+    :param keep: Folder name to spare (the deck of the current videos), or None to delete all.
+    """
+    for parent in parent_dirs:
+        if not os.path.isdir(parent):
+            continue
+        for name in os.listdir(parent):
+            path = os.path.join(parent, name)
+            if name != keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ✅ Each process writes its metrics here so the web process can serve all of them
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join("instance", "metrics"))
+
+# Histogram buckets in seconds (stages range from milliseconds to many minutes)
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# ✅ In-process metrics keyed by (name, labels)
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}  # key -> [bucket counts..., +Inf count], sum
+
+_current_trace = contextvars.ContextVar("job_trace", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Adds value to the counter `name`."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Sets the gauge `name` to value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    """Records one duration (in seconds) in the histogram `name`."""
+    key = _key(name, labels)
+    with _lock:
+        counts, total = _histograms.get(key, ([0] * (len(BUCKETS) + 1), 0.0))
+        counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        _histograms[key] = (counts, total + seconds)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Times the enclosed block and records it with observe()."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def stage(name, **attrs):
+    """
+    Times one pipeline stage: recorded in the stage_duration_seconds
+    histogram and, when a job trace is active, as a span in that trace.
+    attrs (e.g. slide=3) only go to the trace, never to metric labels.
+    """
+    start = time.perf_counter()
+    started_at = time.time()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        observe("stage_duration_seconds", duration, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, started_at, duration, error=error, **attrs)
+
+
+def add_bytes(stage_name, nbytes):
+    """Counts bytes read or written by a stage."""
+    inc("stage_bytes_total", nbytes, stage=stage_name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_bytes(stage_name, nbytes)
+
+
+class JobTrace:
+    """Spans and byte counts of one job, written as JSON when the job ends."""
+
+    def __init__(self, path, **info):
+        self.path = path
+        self.info = dict(info, started_at=time.time())
+        self.spans = []
+        self.bytes = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, started_at, duration, **attrs):
+        span = {"stage": name, "start": round(started_at, 3), "duration": round(duration, 4)}
+        span.update({k: v for k, v in attrs.items() if v is not None})
+        with self._lock:
+            self.spans.append(span)
+
+    def add_bytes(self, stage_name, nbytes):
+        with self._lock:
+            self.bytes[stage_name] = self.bytes.get(stage_name, 0) + nbytes
+
+    def summary(self):
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                entry = totals.setdefault(span["stage"], {"count": 0, "seconds": 0.0})
+                entry["count"] += 1
+                entry["seconds"] = round(entry["seconds"] + span["duration"], 4)
+        return totals
+
+    def save(self, **info):
+        self.info.update(info, finished_at=time.time())
+        stages = self.summary()
+        with self._lock:
+            payload = {"job": self.info, "stages": stages, "bytes": dict(self.bytes), "spans": list(self.spans)}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+
+
+@contextmanager
+def job_trace(path, **info):
+    """Makes a JobTrace current for the enclosed block and saves it afterwards."""
+    trace = JobTrace(path, **info)
+    token = _current_trace.set(trace)
+    status = "failed"
+    try:
+        yield trace
+        status = "done"
+    finally:
+        _current_trace.reset(token)
+        trace.save(status=status)
+
+
+def snapshot():
+    """Returns a copy of all metrics as JSON-serialisable dicts."""
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "counters": [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, list(labels), value] for (name, labels), value in _gauges.items()],
+            "histograms": [[name, list(labels), list(counts), total]
+                           for (name, labels), (counts, total) in _histograms.items()],
+        }
+
+
+def flush(directory=METRICS_DIR):
+    """Writes this process's metrics to METRICS_DIR/<pid>.json."""
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, os.path.join(directory, f"{os.getpid()}.json"))
+
+
+def reset_directory(directory=METRICS_DIR):
+    """Removes metric files left by earlier runs."""
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(directory, filename))
+
+
+def remove(pid, directory=METRICS_DIR):
+    """Deletes the metrics file of a process that has exited (e.g. a crashed worker)."""
+    try:
+        os.remove(os.path.join(directory, f"{pid}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def collect(directory=METRICS_DIR):
+    """
+    Merges this process's metrics with every flushed snapshot in directory.
+
+    Counters and histograms are summed. Gauges are a value per process, so
+    each one keeps a pid label instead (adding up every process's copy of
+    e.g. artifact_store_bytes would count the same store several times).
+    """
+    snapshots = [snapshot()]
+    own_file = f"{os.getpid()}.json"
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json") or filename == own_file:
+                continue
+            try:
+                with open(os.path.join(directory, filename), "r") as f:
+                    snap = json.load(f)
+                snap.setdefault("pid", filename[:-len(".json")])
+                snapshots.append(snap)
+            except (OSError, ValueError):
+                continue
+
+    counters, gauges, histograms = {}, {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snap["gauges"]:
+            key = (name, tuple(map(tuple, labels)) + (("pid", str(snap["pid"])),))
+            gauges[key] = value
+        for name, labels, counts, total in snap["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            merged, merged_total = histograms.get(key, ([0] * len(counts), 0.0))
+            histograms[key] = ([a + b for a, b in zip(merged, counts)], merged_total + total)
+    return counters, gauges, histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus(directory=METRICS_DIR):
+    """All metrics from every process in the Prometheus text exposition format."""
+    counters, gauges, histograms = collect(directory)
+    lines = []
+
+    def grouped(items):
+        by_name = {}
+        for (name, labels), value in sorted(items.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        return by_name.items()
+
+    for name, series in grouped(counters):
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(f"{name}{_format_labels(labels)} {value}" for labels, value in series)
+    for name, series in grouped(gauges):
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{name}{_format_labels(labels)} {value}" for labels, value in series)
+    for name, series in grouped(histograms):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(list(BUCKETS) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,106 @@
+import gc
+import os
+import time
+import threading
+from collections import OrderedDict
+import torch
+import whisper
+from utility import metrics
+
+# ✅ Registry configuration (override in .env)
+WHISPER_CACHE_MB = int(os.getenv("WHISPER_CACHE_MB", "4096"))  # memory budget for loaded models
+WHISPER_WARMUP = os.getenv("WHISPER_WARMUP", "")                # e.g. "base" or "base,medium"
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def model_nbytes(model):
+    """Approximate memory held by a model's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class WhisperModelRegistry:
+    """
+    Keeps loaded Whisper models keyed by (size, device) so every job handled
+    by a worker process shares the same weights.
+
+    Models are evicted least-recently-used first once their combined size
+    exceeds the memory budget. The most recently used model is always kept,
+    even if it alone is larger than the budget.
+    """
+
+    def __init__(self, memory_budget_mb=WHISPER_CACHE_MB):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._models = OrderedDict()  # (size, device) -> (model, nbytes)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self, model_size, device=None):
+        device = device or default_device()
+        key = (model_size, device)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                metrics.inc("whisper_model_cache_hits_total", size=model_size, device=device)
+                return self._models[key][0]
+
+        # ✅ Only one load at a time: a second caller for the same key waits and then hits the cache
+        with self._load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    metrics.inc("whisper_model_cache_hits_total", size=model_size, device=device)
+                    return self._models[key][0]
+
+            metrics.inc("whisper_model_cache_misses_total", size=model_size, device=device)
+            print(f"Loading Whisper model: {model_size} on {device}")
+            start = time.perf_counter()
+            with metrics.stage("model_load", size=model_size, device=device):
+                model = whisper.load_model(model_size, device=device)
+            load_time = time.perf_counter() - start
+            metrics.observe("whisper_model_load_seconds", load_time, size=model_size, device=device)
+            print(f"Loaded Whisper model {model_size} in {load_time:.1f}s")
+
+            with self._lock:
+                self._models[key] = (model, model_nbytes(model))
+                self._evict()
+            return model
+
+    def _evict(self):
+        # Caller holds self._lock
+        evicted = False
+        while len(self._models) > 1 and self.total_bytes() > self.memory_budget:
+            (size, device), _ = self._models.popitem(last=False)
+            metrics.inc("whisper_model_evictions_total", size=size, device=device)
+            print(f"♻️ Evicted Whisper model {size} on {device} from cache")
+            evicted = True
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def total_bytes(self):
+        return sum(nbytes for _, nbytes in self._models.values())
+
+    def warm_up(self, sizes=WHISPER_WARMUP):
+        """
+        Loads the given models ahead of the first job.
+
+        :param sizes: Comma-separated string or list of model sizes.
+        """
+        if isinstance(sizes, str):
+            sizes = [s.strip() for s in sizes.split(",") if s.strip()]
+        for size in sizes:
+            self.get(size)
+
+
+# ✅ One registry per process
+registry = WhisperModelRegistry()
+
+
+def get_whisper_model(model_size, device=None):
+    return registry.get(model_size, device)
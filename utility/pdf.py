@@ -1,13 +1,137 @@
+import io
+import os
+import shutil
+import asyncio
+import hashlib
+import tempfile
 import PyPDF2
+from utility import metrics
+from utility.cache import DiskCache
+from utility.scheduler import cpu_slot_async
+
+# ✅ Ingest results are small (text only), keep many documents around
+_pdf_cache = DiskCache("pdf", max_mb=int(os.getenv("PDF_CACHE_MB", "256")))
+RASTER_BATCH_PAGES = int(os.getenv("RASTER_BATCH_PAGES", "8"))  # pages per poppler call
+
+
+def ingest_pdf(pdf_path):
+    """
+    Reads everything later stages need from a PDF in a single open:
+    content hash, page count and per-page text.
+
+    Results are cached by content hash, so a repeat submission of the same
+    document (under any filename) skips parsing entirely.
+
+    :param pdf_path: Path to the PDF file.
+    :return: dict with "sha256", "page_count" and "texts".
+    """
+    with metrics.stage("pdf_ingest"):
+        with open(pdf_path, 'rb') as file:
+            data = file.read()
+        metrics.add_bytes("pdf_ingest", len(data))
+        digest = hashlib.sha256(data).hexdigest()
+
+        cached = _pdf_cache.get_json(digest)
+        if cached is not None:
+            print(f"📚 Reusing cached PDF ingest for {os.path.basename(pdf_path)}")
+            return cached
+
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        texts = [page.extract_text() or "" for page in reader.pages]
+        info = {"sha256": digest, "page_count": len(texts), "texts": texts}
+        _pdf_cache.set_json(digest, info)
+        return info
+
+
+def count_pages(pdf_path):
+    """Page count without extracting any text (0 if the file can't be parsed)."""
+    try:
+        return len(PyPDF2.PdfReader(pdf_path).pages)
+    except Exception:
+        return 0
+
 
 def pdf_to_text_array(pdf_path):
-    texts = []
-    # Open the PDF file in binary mode
-    with open(pdf_path, 'rb') as file:
-        # Create a PDF reader object
-        reader = PyPDF2.PdfReader(file)
-        # Iterate through all the pages and extract text
-        for page in reader.pages:
-            page_text = page.extract_text()
-            texts.append(page_text)
-    return texts
\ No newline at end of file
+    return ingest_pdf(pdf_path)["texts"]
+
+
+def render_pages(pdf_path, first, last, output_paths, size=None, poppler_path=None):
+    """
+    Rasterizes pages first..last (0-based, inclusive) straight to PNG files.
+
+    poppler scales to `size` itself and writes the files; no page is ever
+    decoded into Python memory, so memory use does not grow with the
+    number or size of pages.
+
+    :param output_paths: One destination path per page.
+    :param size: (width, height) in pixels, or None for poppler's default 200 dpi.
+    :return: output_paths
+    """
+    from pdf2image import convert_from_path  # worker-only (pulls in Pillow); the web tier only counts pages
+
+    output_dir = os.path.dirname(output_paths[0]) or "."
+    scratch = tempfile.mkdtemp(dir=output_dir, prefix=".raster-")
+    try:
+        rendered = convert_from_path(
+            pdf_path, poppler_path=poppler_path, first_page=first + 1, last_page=last + 1,
+            size=size, fmt="png", output_folder=scratch, output_file="page", paths_only=True,
+        )
+        if len(rendered) != len(output_paths):
+            raise RuntimeError(f"poppler rendered {len(rendered)} pages, expected {len(output_paths)}")
+        # pdf2image returns the files in page order
+        for source, destination in zip(rendered, output_paths):
+            os.replace(source, destination)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return output_paths
+
+
+class PageRasterizer:
+    """
+    Renders the pages a job needs in runs of up to batch_pages consecutive
+    pages per poppler call (one PDF parse per run instead of per page).
+    A run starts when any of its pages is first requested.
+    """
+
+    def __init__(self, pdf_path, pages, output_path_for, size=None, poppler_path=None,
+                 batch_pages=RASTER_BATCH_PAGES, executor=None):
+        """
+        :param pages: 0-based page indices that need rendering.
+        :param output_path_for: callable(idx) -> PNG path for that page.
+        :param executor: Executor for the blocking poppler calls (None = default thread pool).
+        """
+        self.pdf_path = pdf_path
+        self.output_path_for = output_path_for
+        self.size = size
+        self.poppler_path = poppler_path
+        self.executor = executor
+        self._run_of = {}   # page -> run number
+        self._runs = []     # run number -> list of consecutive pages
+        self._tasks = {}    # run number -> task
+        for idx in sorted(set(pages)):
+            run = self._runs[-1] if self._runs else None
+            if run is None or idx != run[-1] + 1 or len(run) >= max(1, batch_pages):
+                self._runs.append([idx])
+            else:
+                run.append(idx)
+            self._run_of[idx] = len(self._runs) - 1
+
+    async def render(self, idx):
+        """Waits until page idx is on disk and returns its path."""
+        if idx not in self._run_of:
+            raise KeyError(f"Page {idx} was not scheduled for rendering")
+        number = self._run_of[idx]
+        task = self._tasks.get(number)
+        # ✅ A failed run starts over on the next request (slide retries get a new poppler call)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = self._tasks[number] = asyncio.ensure_future(self._render_run(self._runs[number]))
+        await asyncio.shield(task)
+        return self.output_path_for(idx)
+
+    async def _render_run(self, run):
+        loop = asyncio.get_running_loop()
+        async with cpu_slot_async("rasterization"):
+            await loop.run_in_executor(
+                self.executor, render_pages, self.pdf_path, run[0], run[-1],
+                [self.output_path_for(i) for i in run], self.size, self.poppler_path,
+            )
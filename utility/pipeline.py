@@ -0,0 +1,127 @@
+import os
+import asyncio
+from utility import metrics
+
+# ✅ Items allowed to wait between two stages (keeps memory flat)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+_DONE = object()
+
+
+class PipelineError(Exception):
+    """
+    Raised by run_pipeline(fail_fast=False) after the other items finished,
+    when some items failed in a stage even after their retries.
+
+    :ivar failures: List of (item, stage name, exception).
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        item, stage, error = failures[0]
+        super().__init__(f"{len(failures)} item(s) failed; first in {stage}: {error}")
+
+
+class Stage:
+    """
+    One step of a streaming pipeline.
+
+    :param name: Used in logs and metrics.
+    :param fn: async callable taking an item and returning the item for the next stage.
+    :param concurrency: Number of items this stage works on at the same time.
+    """
+
+    def __init__(self, name, fn, concurrency=1):
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(1, concurrency)
+
+
+async def run_pipeline(items, stages, queue_size=PIPELINE_QUEUE_SIZE, on_result=None,
+                       retries=0, retry_delay=1.0, fail_fast=True):
+    """
+    Streams items through the stages connected by bounded queues, so item i
+    can be in the last stage while item i+1 is still in the first one.
+
+    Items leave stages in completion order; callers that need the original
+    order should sort the result.
+
+    A stage that raises is re-run on the same item (stage functions must be
+    safe to repeat) until the item has used up its retries, with exponential
+    backoff starting at retry_delay. After that, fail_fast=True cancels the
+    whole pipeline and re-raises; fail_fast=False drops the item, lets the
+    others finish and raises PipelineError at the end.
+
+    :param on_result: Optional callback(item) called as each item leaves the last stage.
+    :param retries: Retry budget of each item, shared by all stages.
+    :return: List of items returned by the last stage.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    results = []
+    failures = []
+    retries_used = {}  # id(item) -> retries spent so far
+
+    async def call(stage, item):
+        while True:
+            try:
+                return await stage.fn(item)
+            except Exception as e:
+                used = retries_used.get(id(item), 0)
+                if used >= retries:
+                    raise
+                retries_used[id(item)] = used + 1
+                metrics.inc("pipeline_retries_total", stage=stage.name)
+                print(f"🔁 {stage.name} failed ({e}); retrying ({used + 1}/{retries})...")
+                await asyncio.sleep(retry_delay * 2 ** used)
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        for _ in range(stages[0].concurrency):
+            await queues[0].put(_DONE)
+
+    async def work(position, stage):
+        inbox = queues[position]
+        outbox = queues[position + 1] if position + 1 < len(stages) else None
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            metrics.set_gauge("pipeline_queue_depth", inbox.qsize(), stage=stage.name)
+            try:
+                item = await call(stage, item)
+            except Exception as e:
+                if fail_fast:
+                    raise
+                metrics.inc("pipeline_failed_items_total", stage=stage.name)
+                failures.append((item, stage.name, e))
+                continue
+            if outbox is None:
+                results.append(item)
+                if on_result is not None:
+                    on_result(item)
+            else:
+                await outbox.put(item)
+
+    async def run_stage(position, stage):
+        await asyncio.gather(*(work(position, stage) for _ in range(stage.concurrency)))
+        # ✅ Tell every worker of the next stage that no more items are coming
+        if position + 1 < len(stages):
+            for _ in range(stages[position + 1].concurrency):
+                await queues[position + 1].put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())]
+    tasks += [asyncio.ensure_future(run_stage(position, stage)) for position, stage in enumerate(stages)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        for stage in stages:
+            metrics.set_gauge("pipeline_queue_depth", 0, stage=stage.name)
+    if failures:
+        raise PipelineError(failures)
+    return results
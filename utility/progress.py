@@ -0,0 +1,51 @@
+import os
+import time
+from utility.job_queue import JobCancelled
+
+# ✅ Progress is written to the job database at most this often (stage changes are always written)
+PROGRESS_MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", "1"))
+
+
+class ProgressReporter:
+    """
+    Callable passed to api() as on_progress(stage, done=None, total=None).
+
+    Publishes the current stage, "item done of total" and an ETA to the job
+    queue, where the status and SSE endpoints read it. The ETA is the
+    stage's throughput so far applied to the items that are left.
+    """
+
+    def __init__(self, queue, job_id, attempt=None, min_interval=PROGRESS_MIN_INTERVAL):
+        self.queue = queue
+        self.job_id = job_id
+        self.attempt = attempt
+        self.min_interval = min_interval
+        self.stage = None
+        self.stage_started = None
+        self.last_written = 0.0
+
+    def __call__(self, stage, done=None, total=None):
+        now = time.time()
+        changed = stage != self.stage
+        if changed:
+            self.stage = stage
+            self.stage_started = now
+
+        eta = None
+        if done and total:
+            eta = round((now - self.stage_started) / done * (total - done), 1)
+
+        finished = done is not None and done == total
+        if not (changed or finished) and now - self.last_written < self.min_interval:
+            return
+        self.last_written = now
+        try:
+            running = self.queue.set_progress(self.job_id, {
+                "stage": stage, "done": done, "total": total, "eta_seconds": eta, "updated_at": now,
+            }, attempt=self.attempt)
+        except Exception as e:
+            # ⚠️ Progress is best effort; never fail a job because of it
+            print(f"⚠️ Could not save progress: {e}")
+            return
+        if not running:
+            raise JobCancelled(f"Job {self.job_id} was cancelled or taken over.")
@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager, asynccontextmanager
+from utility import metrics
+
+# ✅ Machine-wide limit on CPU-heavy stages (Whisper, rasterization, ffmpeg encode) across all jobs
+CPU_SLOTS = int(os.getenv("CPU_SLOTS", "0")) or os.cpu_count() or 1
+CPU_SLOT_POLL = 0.05  # seconds between attempts while an async stage waits for a slot
+
+_slots = None
+
+
+class CpuSlots:
+    """
+    Counting semaphore shared by every worker process (create it in the
+    parent, pass it to the workers). CPU-bound stages of all jobs take a
+    slot while they run, so I/O-bound stages (Gemini, TTS) of one job never
+    hold CPU capacity another job could use, and concurrent jobs never
+    oversubscribe the cores.
+
+    A multi-threaded stage (e.g. torch running Whisper on several threads)
+    takes one slot per thread. Multi-slot requests gather their slots one
+    at a time under a shared lock, so two of them can never each hold part
+    of what the other needs.
+
+    Holders are recorded by pid so the supervisor can reclaim the slots of
+    a worker it saw exit.
+    """
+
+    def __init__(self, ctx, size=CPU_SLOTS):
+        self.size = size
+        self._semaphore = ctx.BoundedSemaphore(size)
+        self._holders = ctx.Array("i", size)
+        self._gather = ctx.Lock()
+
+    def acquire(self, block=True, count=1):
+        """
+        :param count: Slots to take (capped at size); all of them or none.
+        :return: False if block=False and the slots are not free right now.
+        """
+        count = max(1, min(count, self.size))
+        if count == 1:
+            return self._take(block)
+        if not self._gather.acquire(block):
+            return False
+        try:
+            for taken in range(count):
+                if not self._take(block):
+                    self.release(taken)
+                    return False
+            return True
+        finally:
+            self._gather.release()
+
+    def release(self, count=1):
+        for _ in range(max(0, min(count, self.size))):
+            self._give()
+
+    def _take(self, block):
+        if not self._semaphore.acquire(block):
+            return False
+        pid = os.getpid()
+        with self._holders.get_lock():
+            for i in range(self.size):
+                if self._holders[i] == 0:
+                    self._holders[i] = pid
+                    break
+        return True
+
+    def _give(self):
+        pid = os.getpid()
+        with self._holders.get_lock():
+            for i in range(self.size):
+                if self._holders[i] == pid:
+                    self._holders[i] = 0
+                    break
+        self._semaphore.release()
+
+    def reclaim(self, pid):
+        """Releases the slots held by a worker process that has exited. Returns how many."""
+        reclaimed = 0
+        with self._holders.get_lock():
+            for i in range(self.size):
+                if pid and self._holders[i] == pid:
+                    self._holders[i] = 0
+                    self._semaphore.release()
+                    reclaimed += 1
+        return reclaimed
+
+
+class _Unlimited:
+    """Used when no shared slots were configured (e.g. running api() directly)."""
+
+    size = CPU_SLOTS
+
+    def acquire(self, block=True, count=1):
+        return True
+
+    def release(self, count=1):
+        pass
+
+
+def set_cpu_slots(slots):
+    """Installs the shared slots in this process (called once per worker)."""
+    global _slots
+    _slots = slots
+
+
+def get_cpu_slots():
+    return _slots if _slots is not None else _Unlimited()
+
+
+@contextmanager
+def cpu_slot(stage_name, count=1):
+    """Holds count CPU slots (one per thread the block uses) for the enclosed (blocking) block."""
+    slots = get_cpu_slots()
+    start = time.perf_counter()
+    slots.acquire(count=count)
+    metrics.observe("cpu_slot_wait_seconds", time.perf_counter() - start, stage=stage_name)
+    try:
+        yield
+    finally:
+        slots.release(count)
+
+
+@asynccontextmanager
+async def cpu_slot_async(stage_name):
+    """
+    Async version of cpu_slot(). Waits without blocking the event loop,
+    so the job's network-bound stages keep running meanwhile.
+    """
+    slots = get_cpu_slots()
+    start = time.perf_counter()
+    while not slots.acquire(block=False):
+        await asyncio.sleep(CPU_SLOT_POLL)
+    metrics.observe("cpu_slot_wait_seconds", time.perf_counter() - start, stage=stage_name)
+    try:
+        yield
+    finally:
+        slots.release()
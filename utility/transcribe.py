@@ -0,0 +1,166 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from utility import metrics
+from utility.scheduler import get_cpu_slots
+
+# ✅ Chunked transcription configuration (override in .env)
+TRANSCRIBE_MODE = os.getenv("TRANSCRIBE_MODE", "auto")                 # auto | single | chunked
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "120"))    # target chunk length
+CHUNKED_MIN_SECONDS = float(os.getenv("TRANSCRIBE_CHUNKED_MIN_SECONDS", "600"))  # "auto" threshold
+SPLIT_SEARCH_SECONDS = 15.0   # how far from the target point we look for silence
+FRAME_SECONDS = 0.03          # energy analysis frame
+
+_transcribe_pool = None
+
+
+ENERGY_BLOCK_FRAMES = 4096   # frames per block (~2 minutes, ~8 MB of float32 at 16 kHz)
+
+
+def frame_energy(samples, sample_rate, frame_seconds=FRAME_SECONDS):
+    """
+    RMS energy per frame. Works through the signal in blocks of frames, so a
+    memory-mapped recording is never copied into RAM as a whole.
+    """
+    frame_len = max(1, int(sample_rate * frame_seconds))
+    n_frames = len(samples) // frame_len
+    energy = np.zeros(n_frames, dtype=np.float32)
+    for first in range(0, n_frames, ENERGY_BLOCK_FRAMES):
+        last = min(first + ENERGY_BLOCK_FRAMES, n_frames)
+        frames = np.asarray(samples[first * frame_len:last * frame_len], dtype=np.float32).reshape(last - first, frame_len)
+        energy[first:last] = np.einsum("ij,ij->i", frames, frames) / frame_len
+    return np.sqrt(energy), frame_len
+
+
+def find_split_points(samples, sample_rate, chunk_seconds=CHUNK_SECONDS, search_seconds=SPLIT_SEARCH_SECONDS):
+    """
+    Picks split positions (in samples) close to every chunk_seconds mark,
+    placing each one in the quietest stretch of audio within
+    +/- search_seconds so that no word is cut in half.
+    """
+    energy, frame_len = frame_energy(samples, sample_rate)
+    if len(energy) == 0:
+        return []
+    # ✅ Smooth over ~0.3 s so a split lands inside a pause, not between two syllables
+    window = 10
+    smoothed = np.convolve(energy, np.ones(window) / window, mode="same")
+
+    frames_per_chunk = int(chunk_seconds / FRAME_SECONDS)
+    search = int(search_seconds / FRAME_SECONDS)
+    points = []
+    target = frames_per_chunk
+    while target < len(smoothed) - search:
+        lo, hi = max(0, target - search), min(len(smoothed), target + search)
+        quietest = lo + int(np.argmin(smoothed[lo:hi]))
+        points.append(quietest * frame_len)
+        target = quietest + frames_per_chunk
+    return points
+
+
+def split_audio(samples, sample_rate, chunk_seconds=CHUNK_SECONDS):
+    """Returns [(start_sample, end_sample), ...] covering the whole recording."""
+    bounds = [0] + find_split_points(samples, sample_rate, chunk_seconds) + [len(samples)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def chunk_threads():
+    """torch threads of each pool process; a chunk holds this many CPU slots while it runs."""
+    return max(1, (os.cpu_count() or 1) // TRANSCRIBE_WORKERS)
+
+
+def get_transcribe_pool():
+    """CPU process pool shared by every job in this worker process."""
+    global _transcribe_pool
+    if _transcribe_pool is None:
+        threads = chunk_threads()
+        _transcribe_pool = ProcessPoolExecutor(
+            max_workers=TRANSCRIBE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads,),
+        )
+    return _transcribe_pool
+
+
+def shutdown_transcribe_pool():
+    """Stops this process's transcription processes (cancels queued chunks, waits for running ones)."""
+    global _transcribe_pool
+    if _transcribe_pool is not None:
+        pool, _transcribe_pool = _transcribe_pool, None
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _transcribe_chunk(samples, model_size, offset_seconds):
+    # Runs in a pool process; the model stays loaded there between chunks and jobs
+    from utility.model_registry import get_whisper_model
+
+    model = get_whisper_model(model_size, "cpu")
+    result = model.transcribe(samples, fp16=False)
+    segments = []
+    for segment in result.get("segments", []):
+        segment = dict(segment)
+        segment["start"] += offset_seconds
+        segment["end"] += offset_seconds
+        segments.append(segment)
+    return {"text": result.get("text", "").strip(), "segments": segments, "language": result.get("language")}
+
+
+def transcribe_chunked(samples, model_size="base", sample_rate=16000, on_partial=None):
+    """
+    Splits the recording at pauses and transcribes the chunks in parallel
+    worker processes, then merges them with timestamps relative to the
+    whole recording.
+
+    :param on_partial: Optional callback(text_so_far) called whenever the
+                       transcript grows; chunks are reported in order.
+    :return: dict shaped like model.transcribe(): "text", "segments", "language".
+    """
+    chunks = split_audio(samples, sample_rate)
+    print(f"✂️ Split audio into {len(chunks)} chunks for {TRANSCRIBE_WORKERS} worker(s)")
+    metrics.inc("transcribe_chunks_total", len(chunks))
+
+    pool = get_transcribe_pool()
+    slots = get_cpu_slots()
+    threads = min(chunk_threads(), slots.size)
+    waiting = list(enumerate(chunks))
+    futures = {}
+    results = {}
+    emitted = 0
+    pending = set()
+    while waiting or pending:
+        # ✅ Each chunk in flight holds a machine-wide CPU slot per torch thread; block only when nothing is running
+        while waiting and slots.acquire(block=not pending, count=threads):
+            position, (start, end) = waiting.pop(0)
+            future = pool.submit(_transcribe_chunk, np.array(samples[start:end], dtype=np.float32), model_size, start / sample_rate)
+            future.add_done_callback(lambda _: slots.release(threads))
+            futures[future] = position
+            pending.add(future)
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[futures[future]] = future.result()
+        # ✅ Stream the transcript forward as soon as the next chunk in order is ready
+        grew = False
+        while emitted in results:
+            emitted += 1
+            grew = True
+        if grew and on_partial is not None:
+            on_partial(" ".join(results[i]["text"] for i in range(emitted)))
+
+    ordered = [results[i] for i in range(len(chunks))]
+    segments = []
+    for result in ordered:
+        for segment in result["segments"]:
+            segment["id"] = len(segments)
+            segments.append(segment)
+    return {
+        "text": " ".join(result["text"] for result in ordered if result["text"]),
+        "segments": segments,
+        "language": next((r["language"] for r in ordered if r["language"]), None),
+    }
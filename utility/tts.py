@@ -0,0 +1,80 @@
+import os
+import shutil
+import random
+import asyncio
+import edge_tts
+from utility import metrics
+from utility.cache import DiskCache, hash_key
+
+# ✅ TTS configuration (override in .env)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "8"))   # simultaneous synthesis requests
+TTS_MAX_RETRIES = int(os.getenv("TTS_MAX_RETRIES", "3"))
+TTS_RATE = os.getenv("TTS_RATE", "+20%")
+TTS_ENDPOINT = os.getenv("TTS_ENDPOINT", "")               # optional local stand-in, e.g. http://127.0.0.1:8765/tts
+
+_audio_cache = DiskCache("tts", max_mb=int(os.getenv("TTS_CACHE_MB", "1024")))
+
+
+async def _synthesize_edge(text, voice, rate, output_file_path):
+    communicate = edge_tts.Communicate(text, voice, rate=rate)
+    await communicate.save(output_file_path)
+
+
+async def _synthesize_http(text, voice, rate, output_file_path, endpoint):
+    """
+    Posts {"text", "voice", "rate"} as JSON to `endpoint` and stores the mp3
+    bytes it answers with. Used to run the pipeline against a local stub.
+    """
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(endpoint, json={"text": text, "voice": voice, "rate": rate}) as response:
+            response.raise_for_status()
+            data = await response.read()
+    with open(output_file_path, "wb") as f:
+        f.write(data)
+
+
+async def synthesize_speech(text, output_dir, filename, voice="en-US-KaiNeural", rate=TTS_RATE,
+                            semaphore=None, max_retries=TTS_MAX_RETRIES, endpoint=TTS_ENDPOINT):
+    """
+    Generates speech for one slide, reusing cached audio for identical
+    (text, voice, rate) and retrying transient failures.
+
+    :param semaphore: Optional asyncio.Semaphore bounding concurrent requests.
+    :return: Full path of the saved audio file, or None if synthesis failed.
+    """
+    if not text or text.strip() == "":
+        print("⚠️ Warning: Received empty text for speech synthesis.")
+        return None  # Skip empty text
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_file_path = os.path.join(output_dir, filename)
+
+    # ✅ Unchanged slide -> copy the cached mp3, no network round trip
+    cache_key = hash_key(text, voice, rate)
+    cached = _audio_cache.get_file(cache_key, ".mp3")
+    if cached is not None:
+        shutil.copyfile(cached, output_file_path)
+        return output_file_path
+
+    semaphore = semaphore or asyncio.Semaphore(1)
+    for attempt in range(max_retries):
+        try:
+            async with semaphore:
+                with metrics.timer("tts_request_seconds"):
+                    if endpoint:
+                        await _synthesize_http(text, voice, rate, output_file_path, endpoint)
+                    else:
+                        await _synthesize_edge(text, voice, rate, output_file_path)
+            break
+        except Exception as e:
+            metrics.inc("tts_retries_total")
+            print(f"❌ Error saving audio ({attempt + 1}/{max_retries}): {e}")
+            if attempt + 1 < max_retries:
+                await asyncio.sleep(random.uniform(0, 2 ** attempt))
+    else:
+        return None
+
+    _audio_cache.put_file(cache_key, output_file_path, ".mp3")
+    return output_file_path
@@ -0,0 +1,163 @@
+import os
+import shutil
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from utility import metrics
+
+# ✅ Encoder configuration (override in .env)
+VIDEO_FPS = int(os.getenv("VIDEO_FPS", "2"))                        # slides are still images
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "0")) or os.cpu_count() or 1
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "64k")
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "6"))
+
+_encode_pool = None
+
+
+def get_encode_pool():
+    """Process pool shared by every job in this worker process."""
+    global _encode_pool
+    if _encode_pool is None:
+        _encode_pool = ProcessPoolExecutor(
+            max_workers=ENCODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _encode_pool
+
+
+def shutdown_encode_pool():
+    """Stops this process's encoder processes (cancels queued segments, waits for running ones)."""
+    global _encode_pool
+    if _encode_pool is not None:
+        pool, _encode_pool = _encode_pool, None
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def reset_encode_pool(broken):
+    """Drops a broken pool (e.g. an encoder was OOM-killed); the next get_encode_pool() starts a new one."""
+    global _encode_pool
+    if _encode_pool is broken:
+        _encode_pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+def encode_renditions(image_path, audio_path, renditions, fps=VIDEO_FPS):
+    """
+    Encodes one slide at several sizes in a single ffmpeg run: the still
+    image and the audio are decoded once, the video is split and scaled
+    per rendition, and every rendition is written to its own file.
+
+    Every segment is written with identical codec settings so that the
+    segments of one rendition can later be joined with stream copy.
+
+    :param renditions: List of (output_path, width, height).
+    :return: List of output paths.
+    """
+    branches = "".join(f"[v{i}]" for i in range(len(renditions)))
+    graph = [f"[0:v]split={len(renditions)}{branches}"]
+    graph += [f"[v{i}]scale={width}:{height}:flags=lanczos,setsar=1,format=yuv420p[out{i}]"
+              for i, (_, width, height) in enumerate(renditions)]
+
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-loop", "1", "-framerate", str(fps), "-i", image_path,
+        "-i", audio_path,
+        "-filter_complex", ";".join(graph),
+    ]
+    for i, (output_path, _, _) in enumerate(renditions):
+        command += [
+            "-map", f"[out{i}]", "-map", "1:a",
+            "-c:v", "libx264", "-tune", "stillimage", "-preset", "veryfast", "-r", str(fps),
+            "-c:a", "aac", "-b:a", AUDIO_BITRATE, "-ar", "44100", "-ac", "1",
+            "-shortest", "-threads", "1",
+            output_path,
+        ]
+    # Runs inside the encode pool; the caller times it (metrics here would stay in the pool process)
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    return [output_path for output_path, _, _ in renditions]
+
+
+def concat_segments(segment_paths, output_path):
+    """
+    Joins encoded segments with the concat demuxer (no re-encode).
+
+    The moov atom is moved to the front (faststart) so browsers can start
+    playing and seeking before the whole file has arrived. The file is
+    written under a temporary name and renamed, so a half-written video is
+    never served.
+    """
+    list_path = output_path + ".txt"
+    partial_path = output_path + ".part"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-c", "copy", "-movflags", "+faststart", "-f", "mp4",
+        partial_path,
+    ]
+    try:
+        with metrics.stage("concat"):
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        os.replace(partial_path, output_path)
+    finally:
+        os.remove(list_path)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    metrics.add_bytes("concat", os.path.getsize(output_path))
+    return output_path
+
+
+def package_hls(renditions, output_dir, segment_seconds=HLS_SEGMENT_SECONDS):
+    """
+    Repackages finished MP4 renditions as an HLS ladder (stream copy, no
+    re-encode): one fMP4 playlist per rendition plus master.m3u8.
+
+    :param renditions: List of (mp4_path, width, height, name), e.g. name "480p".
+    :return: Path of master.m3u8
+    """
+    remove_hls(output_dir)  # no renditions left over from an earlier ladder
+    entries = []
+    with metrics.stage("hls"):
+        for mp4_path, width, height, name in renditions:
+            rendition_dir = os.path.join(output_dir, name)
+            os.makedirs(rendition_dir, exist_ok=True)
+            command = [
+                "ffmpeg", "-y", "-loglevel", "error", "-i", mp4_path,
+                "-c", "copy", "-f", "hls",
+                "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+                "-hls_segment_type", "fmp4",
+                "-hls_segment_filename", os.path.join(rendition_dir, "segment_%04d.m4s"),
+                os.path.join(rendition_dir, "index.m3u8"),
+            ]
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+            entries.append((name, width, height, _average_bitrate(mp4_path)))
+
+    master_path = os.path.join(output_dir, "master.m3u8")
+    with open(master_path, "w", encoding="utf-8") as f:
+        f.write("#EXTM3U\n#EXT-X-VERSION:7\n")
+        for name, width, height, bandwidth in sorted(entries, key=lambda entry: entry[3]):
+            f.write(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}\n{name}/index.m3u8\n")
+    return master_path
+
+
+def remove_hls(output_dir):
+    """Deletes an HLS ladder written by package_hls()."""
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def _average_bitrate(mp4_path):
+    command = [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", mp4_path,
+    ]
+    output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    try:
+        duration = float(output.strip())
+    except ValueError:
+        duration = 0.0
+    size_bits = os.path.getsize(mp4_path) * 8
+    return int(size_bits / duration) if duration > 0 else size_bits
@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import signal
+import shutil
+import atexit
+import asyncio
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+from utility.job_queue import JobQueue, JobCancelled, JOB_LEASE_SECONDS
+from utility.progress import ProgressReporter
+from utility.scheduler import CpuSlots, set_cpu_slots
+from utility.artifacts import get_store, video_owner
+from utility import metrics
+load_dotenv()
+
+# ✅ Worker pool configuration (override in .env)
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "2"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+
+
+# ✅ Background Processing Task
+def run_processing(video_path, pdf_path, num_of_pages, resolution, user_folder, voice, slide_overrides=None,
+                   resolutions=None, hls=False, dedup=None, job_id=None, on_progress=None):
+    """:return: Paths of the final videos."""
+    from api.whisper_LLM_api import api
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    # ✅ Per-job trace (stage spans, durations, bytes) saved next to the job's outputs
+    trace_path = os.path.join(user_folder, f"trace_{job_id or int(time.time())}.json")
+    try:
+        with metrics.job_trace(trace_path, job_id=job_id, pdf=os.path.basename(pdf_path), resolution=resolution):
+            outputs = loop.run_until_complete(api(
+                video_path=video_path,
+                pdf_file_path=pdf_path,
+                #poppler_path=None if system_os == "Windows" else "./poppler/poppler-0.89.0/bin",
+                poppler_path=None,
+                output_audio_dir=os.path.join(user_folder, 'audio'),
+                output_video_dir=os.path.join(user_folder, 'video'),
+                output_text_path=os.path.join(user_folder, "text_output.txt"),
+                num_of_pages=num_of_pages,
+                resolution=int(resolution),
+                tts_model=voice,
+                slide_overrides=slide_overrides,
+                on_progress=on_progress,
+                resolutions=resolutions,
+                hls=hls,
+                dedup=dedup
+            ))
+        print("✅ Video Processing Completed!")
+        return outputs
+    except Exception as e:
+        print(f"❌ Error during processing: {e}")
+        raise
+    finally:
+        loop.close()
+
+
+def release_uploads(user_id, upload_owner, outputs):
+    """
+    Hands the job's references on its uploads over to the videos made from
+    them, so the uploads live as long as one of those videos does (re-renders
+    with edited slides need them) and become evictable after that.
+    """
+    try:
+        store = get_store()
+        shas = store.shas_of(upload_owner)
+        for output in outputs or []:
+            store.replace_refs(video_owner(user_id, os.path.basename(output)), shas)
+        store.release(upload_owner)
+        store.enforce_quota()
+    except Exception as e:
+        print(f"⚠️ Could not update upload references: {e}")
+
+
+def _exit_worker(signum, frame):
+    """
+    SIGTERM handler (WorkerPool.stop): stops the encode and transcription
+    pools this worker started, then exits normally. Exiting waits for child
+    processes, and pool processes only leave once their pool shuts down.
+    """
+    for module_name, shutdown in (("utility.video", "shutdown_encode_pool"),
+                                  ("utility.transcribe", "shutdown_transcribe_pool")):
+        module = sys.modules.get(module_name)  # never import the engine just to stop it
+        if module is not None:
+            getattr(module, shutdown)()
+    sys.exit(0)
+
+
+def worker_loop(db_path=None, poll_interval=WORKER_POLL_INTERVAL, cpu_slots=None):
+    """
+    Runs in each worker process: claims one job at a time from the queue,
+    processes it and records the outcome.
+
+    :param cpu_slots: CpuSlots shared with the other workers; CPU-bound
+                      stages of this worker's jobs take a slot while they run.
+    """
+    set_cpu_slots(cpu_slots)
+    signal.signal(signal.SIGTERM, _exit_worker)
+    queue = JobQueue(db_path) if db_path else JobQueue()
+    pid = os.getpid()
+    print(f"👷 Worker {pid} started.")
+
+    # ✅ Optionally load Whisper before the first job arrives (WHISPER_WARMUP)
+    from utility.model_registry import registry
+    try:
+        registry.warm_up()
+    except Exception as e:
+        print(f"⚠️ Whisper warm-up failed: {e}")
+
+    # ✅ Publish this process's metrics for the web process's /metrics endpoint
+    def flush_metrics():
+        while True:
+            try:
+                metrics.flush()
+            except OSError as e:
+                print(f"⚠️ Could not write metrics: {e}")
+            time.sleep(METRICS_FLUSH_INTERVAL)
+
+    threading.Thread(target=flush_metrics, daemon=True).start()
+
+    # ✅ Renew the lease on the running job from a thread of its own, so long blocking stages keep it too
+    current = {"job": None}
+
+    def renew_lease():
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 4)
+            running = current["job"]
+            if running is None:
+                continue
+            try:
+                queue.heartbeat(running["id"], running["attempts"])
+            except Exception as e:
+                print(f"⚠️ Could not renew the lease on job {running['id']}: {e}")
+
+    threading.Thread(target=renew_lease, daemon=True).start()
+
+    while True:
+        job = queue.claim(pid)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        print(f"👷 Worker {pid} picked up job {job['id']} (attempt {job['attempts']}).")
+        start = time.perf_counter()
+        params = dict(job["params"])
+        upload_owner = params.pop("upload_owner", None)
+        requeued = False
+        current["job"] = job
+        try:
+            reporter = ProgressReporter(queue, job["id"], attempt=job["attempts"])
+            outputs = run_processing(job_id=job["id"], on_progress=reporter, **params)
+            if not queue.complete(job["id"], attempt=job["attempts"]):
+                raise JobCancelled(f"Job {job['id']} was cancelled or taken over.")
+            metrics.inc("jobs_finished_total", status="done")
+        except JobCancelled as e:
+            print(f"🛑 {e}")
+            outputs = []
+            latest = queue.get(job["id"])
+            if latest is not None and latest["status"] == "cancelled":
+                # ✅ Its user was deleted: keep no references to its uploads and remove what
+                #    the job wrote after their folder was deleted (checkpoint, trace, renders)
+                metrics.inc("jobs_finished_total", status="cancelled")
+                if params.get("user_folder"):
+                    shutil.rmtree(params["user_folder"], ignore_errors=True)
+            else:
+                # ✅ Lease lost (this worker stalled): the queue has the job again, uploads included
+                requeued = True
+        except Exception as e:
+            outputs = []
+            # ✅ Transient failures: run again later; finished slides are reused from the checkpoint
+            requeued = queue.fail(job["id"], e, retry=True, attempt=job["attempts"])
+            if requeued:
+                print(f"🔁 Job {job['id']} will resume from its checkpoint.")
+                metrics.inc("jobs_retried_total")
+            else:
+                metrics.inc("jobs_finished_total", status="failed")
+        finally:
+            current["job"] = None
+        if upload_owner and not requeued:
+            release_uploads(job["user_id"], upload_owner, outputs)
+        metrics.observe("job_duration_seconds", time.perf_counter() - start)
+        metrics.flush()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of worker processes draining the job queue.
+
+    Each worker runs one job at a time, but CPU-bound stages of every job
+    share CPU_SLOTS machine-wide slots, so the pool can hold more jobs than
+    cores: while one job waits on Gemini or TTS, another one encodes.
+
+    A supervisor thread restarts workers that die (e.g. killed by the OOM
+    killer), hands their unfinished jobs back to the queue and frees the
+    CPU slots they held. It also recovers jobs whose lease expired, e.g.
+    jobs left running by an earlier server process.
+    """
+
+    def __init__(self, size=WORKER_COUNT, db_path=None):
+        self.size = max(1, size)
+        self.db_path = db_path
+        self.queue = JobQueue(db_path) if db_path else JobQueue()
+        # ✅ spawn: never fork a process that may already hold torch / ffmpeg threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self.cpu_slots = CpuSlots(self._ctx)
+        self._processes = []
+        self._stopped = threading.Event()
+
+    def _spawn(self):
+        # Not daemonic: workers start their own encode / transcription process pools
+        process = self._ctx.Process(target=worker_loop, args=(self.db_path, WORKER_POLL_INTERVAL, self.cpu_slots))
+        process.start()
+        return process
+
+    def start(self):
+        metrics.reset_directory()
+        recovered = self._recover()
+        if recovered:
+            print(f"♻️ Recovered {len(recovered)} interrupted job(s).")
+        self._processes = [self._spawn() for _ in range(self.size)]
+        atexit.register(self.stop)
+        threading.Thread(target=self._supervise, daemon=True).start()
+        print(f"🚀 Started {self.size} worker process(es) sharing {self.cpu_slots.size} CPU slot(s).")
+
+    def _recover(self, dead_pids=()):
+        """Requeues abandoned jobs and drops the upload references of those that gave up."""
+        recovered = self.queue.recover(dead_pids)
+        for job in recovered:
+            upload_owner = job["params"].get("upload_owner")
+            if job["status"] == "failed" and upload_owner:
+                release_uploads(job["user_id"], upload_owner, [])
+        return recovered
+
+    def _supervise(self):
+        last_recovery = time.monotonic()
+        while not self._stopped.wait(WORKER_POLL_INTERVAL):
+            for idx, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                print(f"⚠️ Worker {process.pid} exited with code {process.exitcode}. Restarting...")
+                self._recover([process.pid])
+                self.cpu_slots.reclaim(process.pid)
+                metrics.remove(process.pid)
+                self._processes[idx] = self._spawn()
+            if time.monotonic() - last_recovery >= JOB_LEASE_SECONDS / 4:
+                last_recovery = time.monotonic()
+                recovered = self._recover()
+                if recovered:
+                    print(f"♻️ Recovered {len(recovered)} job(s) whose lease expired.")
+
+    def stop(self):
+        self._stopped.set()
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    # ✅ Run the workers without the web server: python -m utility.worker
+    pool = WorkerPool()
+    pool.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop()